@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016, Kirei AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+DNSKEY transport benchmark
+
+Fetches the root DNSKEY RRset repeatedly from a local stub DNS server using
+one-shot transports (UDP without EDNS falling back to TCP, and a new TCP
+connection per query) and the pooled transports of dnssec_ta_tool (UDP with
+EDNS, pooled TCP and pipelined TCP), and reports the round trips and time
+each needs.
+"""
+
+import os
+import sys
+import time
+import argparse
+import dns.flags
+import dns.message
+import dns.query
+import dns.zone
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOP_DIR, 'dnssec_ta_tool'))
+sys.path.insert(0, os.path.join(TOP_DIR, 'dnssec_ta_tool', 'regress'))
+
+import dnssec_ta_tool  # pylint: disable=wrong-import-position
+import stub_dns_server  # pylint: disable=wrong-import-position
+
+DEFAULT_ZONE_FILE = os.path.join(TOP_DIR, 'dnssec_ta_tool', 'regress', 'root.zone')
+DEFAULT_PORT = 5331
+DEFAULT_QUERIES = 200
+TIMEOUT = 5
+
+
+def oneshot_udp_noedns(host, port, count):
+    """UDP without EDNS, retrying truncated answers over a new TCP connection"""
+    for _ in range(count):
+        query = dns.message.make_query('.', 'DNSKEY')
+        response = dns.query.udp(query, host, port=port, timeout=TIMEOUT)
+        if response.flags & dns.flags.TC:
+            dns.query.tcp(query, host, port=port, timeout=TIMEOUT)
+
+
+def oneshot_tcp(host, port, count):
+    """A new TCP connection per query"""
+    for _ in range(count):
+        query = dns.message.make_query('.', 'DNSKEY')
+        dns.query.tcp(query, host, port=port, timeout=TIMEOUT)
+
+
+def pooled_udp_edns(host, port, count):
+    """UDP with EDNS buffer sizing, pooled TCP if still truncated"""
+    for _ in range(count):
+        dnssec_ta_tool.dnskey_query_udp('.', host, port, TIMEOUT)
+
+
+def pooled_tcp(host, port, count):
+    """Sequential queries over a pooled TCP connection"""
+    for _ in range(count):
+        dnssec_ta_tool.dnskey_query_tcp('.', host, port, TIMEOUT)
+
+
+def pipelined_tcp(host, port, count):
+    """All queries pipelined over a pooled TCP connection"""
+    dnssec_ta_tool.dnskey_queries_tcp(['.'] * count, host, port, TIMEOUT)
+
+
+STRATEGIES = [
+    ('oneshot-udp-noedns', oneshot_udp_noedns, False),
+    ('oneshot-tcp', oneshot_tcp, False),
+    ('pooled-udp-edns', pooled_udp_edns, False),
+    ('pooled-tcp', pooled_tcp, False),
+    ('pipelined-tcp', pipelined_tcp, True),
+]
+
+
+def run_strategy(function, pipelined, host, port, count, counters):
+    """Run strategy, return (round trips, seconds, counter deltas)"""
+    before = dict(vars(counters))
+    dnssec_ta_tool.TCP_POOL.close()
+    start = time.perf_counter()
+    function(host, port, count)
+    elapsed = time.perf_counter() - start
+    delta = {name: getattr(counters, name) - before[name]
+             for name in ['udp_queries', 'tcp_queries', 'tcp_connections', 'truncated']}
+    # Each UDP query and TCP handshake is a round trip, as is every TCP
+    # exchange unless the queries were all pipelined into one.
+    tcp_exchanges = 1 if pipelined and delta['tcp_queries'] else delta['tcp_queries']
+    round_trips = delta['udp_queries'] + delta['tcp_connections'] + tcp_exchanges
+    return (round_trips, elapsed, delta)
+
+
+def main():
+    """ Main function"""
+    parser = argparse.ArgumentParser(description='DNSKEY transport benchmark')
+    parser.add_argument("--zone",
+                        dest='zone',
+                        metavar='filename',
+                        default=DEFAULT_ZONE_FILE,
+                        help='zone file served by the stub server')
+    parser.add_argument("--port",
+                        dest='port',
+                        metavar='port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help='stub server port')
+    parser.add_argument("--queries",
+                        dest='queries',
+                        metavar='n',
+                        type=int,
+                        default=DEFAULT_QUERIES,
+                        help='DNSKEY queries per strategy')
+    args = parser.parse_args()
+
+    zone = dns.zone.from_file(args.zone, origin='.', relativize=False)
+    (servers, counters) = stub_dns_server.start_servers(zone, [args.port], [])
+    host = '127.0.0.1'
+
+    print('{:<20} {:>8} {:>8} {:>8} {:>10} {:>10}'.format(
+        'strategy', 'queries', 'conns', 'trunc', 'rtts', 'ms'))
+    baseline = None
+    for (name, function, pipelined) in STRATEGIES:
+        (round_trips, elapsed, delta) = run_strategy(function, pipelined, host,
+                                                     args.port, args.queries, counters)
+        baseline = baseline or round_trips
+        print('{:<20} {:>8} {:>8} {:>8} {:>10} {:>10.1f}'.format(
+            name, delta['udp_queries'] + delta['tcp_queries'], delta['tcp_connections'],
+            delta['truncated'], round_trips, elapsed * 1000))
+    print('round trips saved by pipelining: {}'.format(baseline - round_trips))
+
+    dnssec_ta_tool.TCP_POOL.close()
+    stub_dns_server.stop_servers(servers)
+
+
+if __name__ == "__main__":
+    main()
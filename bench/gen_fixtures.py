@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016, Kirei AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Synthetic fixture generator for the benchmark suite
+
+Writes, for each size in --sizes:
+
+  root-anchors-<n>.xml  root trust anchors with n KeyDigests, one of which
+                        matches the KSK of the synthetic root zone
+  root-<n>.zone         root zone with n TLD delegations (NS, glue and DS),
+                        and an apex DNSKEY RRset signed by the KSK
+  anchors/<tld>.xml     per-TLD trust anchors with --digests KeyDigests
+
+and once, for the largest size:
+
+  children.zone         DNSKEY RRsets for all TLDs (what the DS records
+                        in the root zone point to)
+  csr/<n>.csr           --csrs KSK CSRs as produced by the root KSK ceremony
+
+Fixtures are deterministic for a given --seed, except for RSA keys. Fixtures
+of an earlier run in the same directory are removed first, so no stale TLDs
+or sizes are left behind.
+"""
+
+import os
+import glob
+import shutil
+import random
+import struct
+import argparse
+import base64
+import dns.dnssec
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa
+except ImportError:
+    x509 = None
+
+DEFAULT_SIZES = '10,100,1000'
+DEFAULT_DIGESTS = 8
+DEFAULT_CSRS = 32
+DEFAULT_SEED = 7958
+KEY_POOL_SIZE = 4
+
+RR_OID = '1.3.6.1.4.1.1000.53'
+
+ANCHORS_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<TrustAnchor id="{id}" source="https://github.com/kirei/dnssec-ta-tools/bench">
+<Zone>{zone}</Zone>
+'''
+
+KEYDIGEST = '''<KeyDigest id="{id}"{validity}>
+<KeyTag>{keytag}</KeyTag>
+<Algorithm>{algorithm}</Algorithm>
+<DigestType>2</DigestType>
+<Digest>{digest}</Digest>
+</KeyDigest>
+'''
+
+
+def random_dnskey(rng, flags):
+    """Make DNSKEY rdata with a random (unusable) RSA public key"""
+    key = bytes([3, 1, 0, 1]) + bytes(rng.getrandbits(8) for _ in range(256))
+    return dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.DNSKEY,
+                               '{} 3 8 {}'.format(flags, base64.b64encode(key).decode()))
+
+
+def rsa_dnskey(private_key, flags):
+    """Make RSASHA256 DNSKEY rdata for RSA private key (RFC 3110)"""
+    numbers = private_key.public_key().public_numbers()
+    exponent = numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, 'big')
+    modulus = numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, 'big')
+    key = bytes([len(exponent)]) + exponent + modulus
+    return dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.DNSKEY,
+                               '{} 3 8 {}'.format(flags, base64.b64encode(key).decode()))
+
+
+def sign_rrset(rrset, private_key, dnskey, inception, expiration):
+    """Return RSASHA256 signature over rrset (RFC 4034 section 3.1.8.1)"""
+    owner = rrset.name.to_digestable()
+    signed_data = bytearray(struct.pack('!HBBIIIH', rrset.rdtype, dnskey.algorithm,
+                                        len(rrset.name.labels) - 1, rrset.ttl,
+                                        expiration, inception, dns.dnssec.key_id(dnskey)))
+    signed_data.extend(dns.name.root.to_digestable())
+    for rdata in sorted(rdata.to_digestable(rrset.name) for rdata in rrset):
+        signed_data.extend(owner)
+        signed_data.extend(struct.pack('!HHIH', rrset.rdtype, rrset.rdclass,
+                                       rrset.ttl, len(rdata)))
+        signed_data.extend(rdata)
+    return private_key.sign(bytes(signed_data), padding.PKCS1v15(), hashes.SHA256())
+
+
+def dnskey_text(dnskey):
+    """DNSKEY rdata as text with the key on one line"""
+    return '{} {} {} {}'.format(dnskey.flags, dnskey.protocol, dnskey.algorithm,
+                                base64.b64encode(dnskey.key).decode())
+
+
+def ds_text(ds_rdata):
+    """DS rdata as text with the digest on one line"""
+    return '{} {} {} {}'.format(ds_rdata.key_tag, ds_rdata.algorithm,
+                                ds_rdata.digest_type, ds_rdata.digest.hex())
+
+
+def anchors_xml(rng, zone, ds_rdata, count):
+    """Trust anchor XML with the DS and count - 1 synthetic KeyDigests"""
+    validities = ['', ' validFrom="2010-07-15T00:00:00+00:00"',
+                  ' validFrom="9999-01-01T00:00:00+00:00"',
+                  ' validFrom="2001-01-01T00:00:00+00:00"'
+                  ' validUntil="2002-01-01T00:00:00+00:00"']
+    parts = [ANCHORS_HEADER.format(id='bench-{}'.format(zone), zone=zone)]
+    parts.append(KEYDIGEST.format(id='K0', validity=validities[1],
+                                  keytag=ds_rdata.key_tag,
+                                  algorithm=ds_rdata.algorithm,
+                                  digest=ds_rdata.digest.hex().upper()))
+    for index in range(1, count):
+        parts.append(KEYDIGEST.format(id='K{}'.format(index),
+                                      validity=validities[index % len(validities)],
+                                      keytag=rng.randrange(65536), algorithm=8,
+                                      digest='{:064X}'.format(rng.getrandbits(256))))
+    parts.append('</TrustAnchor>\n')
+    return ''.join(parts)
+
+
+def tld_names(count):
+    """Deterministic TLD names"""
+    names = []
+    for index in range(count):
+        label = ''
+        index += 26
+        while index:
+            (index, rest) = divmod(index, 26)
+            label = chr(ord('a') + rest) + label
+        names.append(label + '.')
+    return names
+
+
+def root_zone(rng, tlds, children, ksk, ksk_private, zsk):
+    """Root zone text with delegations for tlds and a signed apex DNSKEY RRset"""
+    lines = ['.\t86400\tIN\tSOA\ta.root-servers.net. nstld.verisign-grs.com. '
+             '2016101800 1800 900 604800 86400',
+             '.\t518400\tIN\tNS\ta.root-servers.net.']
+    root = dns.name.root
+    dnskey_rrset = dns.rrset.from_rdata_list(root, 172800, [ksk, zsk])
+    for dnskey in dnskey_rrset:
+        lines.append('.\t172800\tIN\tDNSKEY\t{}'.format(dnskey_text(dnskey)))
+    if ksk_private is not None:
+        # Valid from 2010-01-01 until 2099-12-31
+        signature = sign_rrset(dnskey_rrset, ksk_private, ksk, 1262304000, 4102358400)
+        lines.append('.\t172800\tIN\tRRSIG\tDNSKEY 8 0 172800 {} {} {} . {}'.format(
+            '20991231000000', '20100101000000', dns.dnssec.key_id(ksk),
+            base64.b64encode(signature).decode()))
+    for tld in tlds:
+        for server in range(2):
+            lines.append('{}\t172800\tIN\tNS\tns{}.nic.{}'.format(tld, server, tld))
+        ds_rdata = dns.dnssec.make_ds(tld, children[tld], 'SHA256')
+        lines.append('{}\t86400\tIN\tDS\t{}'.format(tld, ds_text(ds_rdata)))
+        for server in range(2):
+            lines.append('ns{}.nic.{}\t172800\tIN\tA\t192.0.2.{}'.format(
+                server, tld, rng.randrange(1, 255)))
+    return '\n'.join(lines) + '\n'
+
+
+def make_csr(private_key, origin, dnskey):
+    """CSR in DER with the DS of dnskey in its subject, as from a KSK ceremony"""
+    ds_rdata = dns.dnssec.make_ds(origin, dnskey, 'SHA256')
+    subject = x509.Name([
+        x509.NameAttribute(x509.oid.NameOID.ORGANIZATION_NAME, 'ICANN'),
+        x509.NameAttribute(x509.oid.NameOID.ORGANIZATIONAL_UNIT_NAME, 'IANA'),
+        x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, 'Root Zone KSK bench'),
+        x509.NameAttribute(x509.ObjectIdentifier(RR_OID),
+                           '{} IN DS {}'.format(origin, ds_text(ds_rdata).upper())),
+    ])
+    csr = x509.CertificateSigningRequestBuilder().subject_name(subject).sign(
+        private_key, hashes.SHA256())
+    return csr.public_bytes(serialization.Encoding.DER)
+
+
+def write_file(filename, contents):
+    """Write text or bytes to file"""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb' if isinstance(contents, bytes) else 'wt') as file_fd:
+        file_fd.write(contents)
+
+
+def remove_fixtures(out):
+    """Remove fixtures of an earlier run from directory"""
+    for filename in glob.glob(os.path.join(out, 'root-*.zone')) + \
+            glob.glob(os.path.join(out, 'root-anchors-*.xml')) + \
+            [os.path.join(out, 'children.zone')]:
+        if os.path.exists(filename):
+            os.unlink(filename)
+    for dirname in ['anchors', 'csr']:
+        shutil.rmtree(os.path.join(out, dirname), ignore_errors=True)
+
+
+def main():
+    """ Main function"""
+    parser = argparse.ArgumentParser(description='Generate benchmark fixtures')
+    parser.add_argument("--out",
+                        dest='out',
+                        metavar='directory',
+                        default='fixtures',
+                        help='output directory')
+    parser.add_argument("--sizes",
+                        dest='sizes',
+                        metavar='n,n,...',
+                        default=DEFAULT_SIZES,
+                        help='fixture sizes (zones, TLDs and KeyDigests)')
+    parser.add_argument("--digests",
+                        dest='digests',
+                        metavar='m',
+                        type=int,
+                        default=DEFAULT_DIGESTS,
+                        help='KeyDigests per TLD trust anchor file')
+    parser.add_argument("--csrs",
+                        dest='csrs',
+                        metavar='n',
+                        type=int,
+                        default=DEFAULT_CSRS,
+                        help='CSRs in CSR archive')
+    parser.add_argument("--seed",
+                        dest='seed',
+                        metavar='n',
+                        type=int,
+                        default=DEFAULT_SEED,
+                        help='random seed')
+    args = parser.parse_args()
+
+    remove_fixtures(args.out)
+    rng = random.Random(args.seed)
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    tlds = tld_names(sizes[-1])
+    children = {tld: random_dnskey(rng, 257) for tld in tlds}
+
+    # Real RSA keys are needed to sign the apex and to make CSRs
+    if x509 is not None:
+        key_pool = [rsa.generate_private_key(public_exponent=65537, key_size=2048)
+                    for _ in range(KEY_POOL_SIZE)]
+        ksk_private = key_pool[0]
+        ksk = rsa_dnskey(ksk_private, 257)
+    else:
+        print('cryptography not available, root zones are unsigned and no CSRs made')
+        key_pool = []
+        ksk_private = None
+        ksk = random_dnskey(rng, 257)
+    zsk = random_dnskey(rng, 256)
+    ksk_ds = dns.dnssec.make_ds(dns.name.root, ksk, 'SHA256')
+
+    for size in sizes:
+        write_file(os.path.join(args.out, 'root-anchors-{}.xml'.format(size)),
+                   anchors_xml(rng, '.', ksk_ds, size))
+        write_file(os.path.join(args.out, 'root-{}.zone'.format(size)),
+                   root_zone(rng, tlds[:size], children, ksk, ksk_private, zsk))
+
+    for tld in tlds:
+        ds_rdata = dns.dnssec.make_ds(tld, children[tld], 'SHA256')
+        write_file(os.path.join(args.out, 'anchors', tld + 'xml'),
+                   anchors_xml(rng, tld, ds_rdata, args.digests))
+    write_file(os.path.join(args.out, 'children.zone'),
+               ''.join('{}\t3600\tIN\tDNSKEY\t{}\n'.format(tld, dnskey_text(children[tld]))
+                       for tld in tlds))
+
+    for index in range(args.csrs if key_pool else 0):
+        private_key = key_pool[index % len(key_pool)]
+        dnskey = rsa_dnskey(private_key, 257)
+        write_file(os.path.join(args.out, 'csr', '{:04d}.csr'.format(index)),
+                   make_csr(private_key, '.', dnskey))
+
+
+if __name__ == "__main__":
+    main()
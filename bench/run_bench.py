@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016, Kirei AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Scaling benchmark suite
+
+Runs the hot paths of dnssec_ta_tool, get_trust_anchor and csr2dnskey over
+fixtures from gen_fixtures.py at growing sizes, each case and size in its
+own process so peak RSS is measured per case. Every case and size is run
+--runs times; results (throughput, latency percentiles and peak RSS, as the
+median over the runs, with the spread of the median latency) are written as
+JSON, and compared against a baseline to detect regressions.
+
+Timings only compare on the machine that made them, so the baseline is not
+kept in the repository: make one locally with "make baseline" before making
+changes, then compare with "make bench".
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import contextlib
+import resource
+import subprocess
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for tool_dir in ['dnssec_ta_tool', 'get_trust_anchor', 'csr2dnskey',
+                 os.path.join('dnssec_ta_tool', 'regress')]:
+    sys.path.insert(0, os.path.join(TOP_DIR, tool_dir))
+
+DEFAULT_FIXTURES = 'fixtures'
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_RUNS = 5
+REPEAT = 20
+TIMEOUT = 5
+
+
+def fixture_sizes(fixtures):
+    """Sizes available in fixtures directory"""
+    return sorted(int(filename[len('root-'):-len('.zone')])
+                  for filename in os.listdir(fixtures)
+                  if filename.startswith('root-') and filename.endswith('.zone'))
+
+
+def tlds(fixtures, size):
+    """First size TLDs with trust anchor files"""
+    return sorted(filename[:-len('xml')]
+                  for filename in os.listdir(os.path.join(fixtures, 'anchors')))[:size]
+
+
+def read_text(filename):
+    """Read text file"""
+    with open(filename, 'rt') as file_fd:
+        return file_fd.read()
+
+
+def timed_ops(function, items):
+    """Call function on each item after one warm-up call, return per-call latencies"""
+    items = list(items)
+    if items:
+        function(items[0])
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def free_port():
+    """Get a currently unused local port number"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def case_ta_tool_ds(fixtures, size):
+    """dnssec_ta_tool: parse TLD trust anchors and select valid DS"""
+    import dnssec_ta_tool
+
+    def parse_and_select(tld):
+        """Parse one trust anchor file"""
+        anchors = read_text(os.path.join(fixtures, 'anchors', tld + 'xml'))
+        (zone, digests) = dnssec_ta_tool.parse_anchors(anchors)
+        dnssec_ta_tool.get_trust_anchors_as_ds(zone, digests, verbose=False)
+    return timed_ops(parse_and_select, tlds(fixtures, size))
+
+
+def case_ta_tool_zonefile(fixtures, size):
+    """dnssec_ta_tool: root DNSKEY RRset from a root zone with size TLDs"""
+    import dnssec_ta_tool
+    zone_file = os.path.join(fixtures, 'root-{}.zone'.format(size))
+    # A fresh index each time, as dnskey_from_zonefile keeps the first one
+    return timed_ops(lambda _: dnssec_ta_tool.ZoneFileIndex(zone_file).dnskey_rrset(
+        dnssec_ta_tool.dns.name.root), range(REPEAT // 4))
+
+
+def ds_rrsets(fixtures, size):
+    """Valid DS RRsets for the first size TLDs"""
+    import dnssec_ta_tool
+    rrsets = []
+    for tld in tlds(fixtures, size):
+        anchors = read_text(os.path.join(fixtures, 'anchors', tld + 'xml'))
+        (zone, digests) = dnssec_ta_tool.parse_anchors(anchors)
+        rrsets.append(dnssec_ta_tool.get_trust_anchors_as_ds(zone, digests, verbose=False))
+    return rrsets
+
+
+@contextlib.contextmanager
+def stub_server(fixtures):
+    """Run stub DNS server for the TLD DNSKEYs, yield its port"""
+    import dns.zone
+    import stub_dns_server
+    zone = dns.zone.from_file(os.path.join(fixtures, 'children.zone'),
+                              origin='.', relativize=False, check_origin=False)
+    port = free_port()
+    (servers, _) = stub_dns_server.start_servers(zone, [port], [])
+    try:
+        yield port
+    finally:
+        stub_dns_server.stop_servers(servers)
+
+
+def case_ta_tool_dnskey_tcp(fixtures, size):
+    """dnssec_ta_tool: match TLD DNSKEYs, one pooled TCP query per zone"""
+    import dnssec_ta_tool
+    rrsets = ds_rrsets(fixtures, size)
+    with stub_server(fixtures) as port:
+        def fetch_dnskey(zone):
+            """Query stub server"""
+            return dnssec_ta_tool.dnskey_query_tcp(zone, '127.0.0.1', port, TIMEOUT)
+        return timed_ops(lambda ds_rrset: dnssec_ta_tool.dnskey_from_ds_rrset(
+            ds_rrset, verbose=False, fetch_dnskey=fetch_dnskey), rrsets)
+
+
+def case_ta_tool_dnskey_pipelined(fixtures, size):
+    """dnssec_ta_tool: match TLD DNSKEYs, all queries pipelined over TCP
+
+    Pipelined answers have no latency of their own, so each op is a whole
+    batch of size zones (compare with size times ta_tool_dnskey_tcp)."""
+    import dnssec_ta_tool
+    rrsets = ds_rrsets(fixtures, size)
+
+    def match_batch(_):
+        """Query all zones in one pipeline, match each answer"""
+        answers = dnssec_ta_tool.dnskey_queries_tcp([rrset.name for rrset in rrsets],
+                                                    '127.0.0.1', port, TIMEOUT)
+        for (ds_rrset, answer) in zip(rrsets, answers):
+            dnssec_ta_tool.dnskey_from_ds_rrset(ds_rrset, verbose=False,
+                                                fetch_dnskey=lambda _, rrset=answer: rrset)
+    with stub_server(fixtures) as port:
+        return timed_ops(match_batch, range(REPEAT // 4))
+
+
+def case_ta_tool_dnskey_zonefile(fixtures, size):
+    """dnssec_ta_tool: match TLD DNSKEYs from the indexed zonefile provider"""
+    import dnssec_ta_tool
+    rrsets = ds_rrsets(fixtures, size)
+    fetch_dnskey = dnssec_ta_tool.dnskey_provider(
+        'zonefile:' + os.path.join(fixtures, 'children.zone'))
+    return timed_ops(lambda ds_rrset: dnssec_ta_tool.dnskey_from_ds_rrset(
+        ds_rrset, verbose=False, fetch_dnskey=fetch_dnskey), rrsets)
+
+
+def case_gta_match(fixtures, size):
+    """get_trust_anchor: extract size KeyDigests, check validity, match the KSK"""
+    import get_trust_anchor
+    trust_anchor_xml = read_text(os.path.join(fixtures, 'root-anchors-{}.xml'.format(size)))
+    ksks = []
+    for line in read_text(os.path.join(fixtures, 'root-{}.zone'.format(size))).splitlines():
+        fields = line.split()
+        if fields[0:4] == ['.', '172800', 'IN', 'DNSKEY'] and fields[4] == '257':
+            ksks.append({'f': fields[4], 'p': fields[5], 'a': fields[6], 'k': fields[7]})
+
+    def extract_and_match(_):
+        """Run steps 4 to 6"""
+        trust_anchors = get_trust_anchor.extract_trust_anchors_from_xml(trust_anchor_xml)
+        valid_trust_anchors = get_trust_anchor.get_valid_trust_anchors(trust_anchors)
+        get_trust_anchor.get_matching_ksk(ksks, valid_trust_anchors)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return timed_ops(extract_and_match, range(REPEAT))
+
+
+def case_gta_inventory(fixtures, size):
+    """get_trust_anchor: index the DS records of size delegations, check them all"""
+    import get_trust_anchor
+    zone_filename = os.path.join(fixtures, 'root-{}.zone'.format(size))
+    children_filename = os.path.join(fixtures, 'children.zone')
+
+    def index_and_check(_):
+        """Read the zone once, check every DS against the child DNSKEYs"""
+        ds_index = {}
+        with open(zone_filename) as zone_file:
+            get_trust_anchor.read_zone_apex(zone_file, ds_index)
+        get_trust_anchor.check_delegations(ds_index, children_filename,
+                                           get_trust_anchor.DEFAULT_INVENTORY_WORKERS)
+    return timed_ops(index_and_check, range(REPEAT))
+
+
+def case_csr2dnskey(fixtures, size):
+    """csr2dnskey: convert up to size CSRs to DNSKEY and DS"""
+    import argparse as csr_argparse
+    import csr2dnskey
+    csr_dir = os.path.join(fixtures, 'csr')
+    csrs = sorted(os.listdir(csr_dir))[:size] if os.path.isdir(csr_dir) else []
+    return timed_ops(lambda csr: csr2dnskey.run(csr_argparse.Namespace(
+        csr=os.path.join(csr_dir, csr), output=os.devnull,
+        output_ds=True, output_dnskey=True)), csrs)
+
+
+CASES = [
+    ('ta_tool_ds', case_ta_tool_ds),
+    ('ta_tool_zonefile', case_ta_tool_zonefile),
+    ('ta_tool_dnskey_tcp', case_ta_tool_dnskey_tcp),
+    ('ta_tool_dnskey_pipelined', case_ta_tool_dnskey_pipelined),
+    ('ta_tool_dnskey_zonefile', case_ta_tool_dnskey_zonefile),
+    ('gta_match', case_gta_match),
+    ('gta_inventory', case_gta_inventory),
+    ('csr2dnskey', case_csr2dnskey),
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_worker(case, fixtures, size):
+    """Run one case at one size in this process, print result as JSON"""
+    latencies = sorted(dict(CASES)[case](fixtures, size))
+    result = {'ops': len(latencies)}
+    if latencies:
+        result.update({
+            'ops_per_sec': len(latencies) / sum(latencies),
+            'min_ms': latencies[0] * 1000,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p90_ms': percentile(latencies, 0.90) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        })
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_kb'] = maxrss // 1024 if sys.platform == 'darwin' else maxrss
+    print(json.dumps(result))
+
+
+def median(values):
+    """Median of values"""
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def combine_runs(runs):
+    """Combine results of repeated runs of one case and size into their medians"""
+    result = {'ops': runs[0]['ops'], 'runs': len(runs),
+              'p50_runs_ms': [run['p50_ms'] for run in runs]}
+    for key in ['ops_per_sec', 'p50_ms', 'p90_ms', 'p99_ms', 'peak_rss_kb']:
+        result[key] = median(run[key] for run in runs)
+    result['min_ms'] = min(run['min_ms'] for run in runs)
+    result['peak_rss_kb'] = int(result['peak_rss_kb'])
+    return result
+
+
+def run_suite(fixtures, cases, runs):
+    """Run cases at all fixture sizes runs times, each in a separate process"""
+    results = {}
+    for case in cases:
+        for size in fixture_sizes(fixtures):
+            case_runs = []
+            for _ in range(runs):
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                                  '--fixtures', fixtures,
+                                                  '--worker', case, str(size)])
+                case_runs.append(json.loads(output.decode().splitlines()[-1]))
+            if not case_runs[0]['ops']:
+                continue
+            result = combine_runs(case_runs)
+            results['{}/{}'.format(case, size)] = result
+            print('{:<36} {:>8} ops {:>10.1f} ops/s  p50 {:>8.3f} ms  p99 {:>8.3f} ms  '
+                  '{:>7} KB'.format('{}/{}'.format(case, size), result['ops'],
+                                    result['ops_per_sec'], result['p50_ms'],
+                                    result['p99_ms'], result['peak_rss_kb']))
+    return {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results}
+
+
+def noise(result):
+    """Spread of the median latency over the runs of result"""
+    return max(result['p50_runs_ms']) - min(result['p50_runs_ms'])
+
+
+def compare_baseline(results, baseline, tolerance):
+    """Return regressions of results against baseline"""
+    regressions = []
+    for (key, base) in sorted(baseline['results'].items()):
+        current = results['results'].get(key)
+        if current is None:
+            continue
+        # The median over runs is compared, allowing for tolerance and for
+        # the run to run spread measured in both the baseline and the results
+        limit = base['p50_ms'] * (1 + tolerance) + max(noise(base), noise(current))
+        if current['p50_ms'] > limit:
+            regressions.append('{}: median latency {:.3f} ms, baseline {:.3f} ms '
+                               '(limit {:.3f} ms)'.format(key, current['p50_ms'],
+                                                          base['p50_ms'], limit))
+        if current['peak_rss_kb'] > base['peak_rss_kb'] * (1 + tolerance):
+            regressions.append('{}: peak RSS {} KB, baseline {} KB'.format(
+                key, current['peak_rss_kb'], base['peak_rss_kb']))
+    return regressions
+
+
+def main():
+    """ Main function"""
+    parser = argparse.ArgumentParser(description='Scaling benchmark suite')
+    parser.add_argument("--fixtures",
+                        dest='fixtures',
+                        metavar='directory',
+                        default=DEFAULT_FIXTURES,
+                        help='fixtures from gen_fixtures.py')
+    parser.add_argument("--case",
+                        dest='cases',
+                        metavar='name',
+                        action='append',
+                        choices=[name for (name, _) in CASES],
+                        help='case to run (all)')
+    parser.add_argument("--output",
+                        dest='output',
+                        metavar='filename',
+                        help='write results as JSON')
+    parser.add_argument("--baseline",
+                        dest='baseline',
+                        metavar='filename',
+                        help='compare results against baseline JSON')
+    parser.add_argument("--tolerance",
+                        dest='tolerance',
+                        metavar='fraction',
+                        type=float,
+                        default=DEFAULT_TOLERANCE,
+                        help='allowed growth of median latency and peak RSS over baseline')
+    parser.add_argument("--runs",
+                        dest='runs',
+                        metavar='n',
+                        type=int,
+                        default=DEFAULT_RUNS,
+                        help='runs of each case and size, to take the median of')
+    parser.add_argument("--worker",
+                        dest='worker',
+                        nargs=2,
+                        metavar=('case', 'size'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], args.fixtures, int(args.worker[1]))
+        return 0
+
+    results = run_suite(args.fixtures, args.cases or [name for (name, _) in CASES], args.runs)
+    if args.output:
+        with open(args.output, 'wt') as output_fd:
+            json.dump(results, output_fd, indent=2, sort_keys=True)
+            output_fd.write('\n')
+    if args.baseline and not os.path.exists(args.baseline):
+        print('No baseline {}, make one on this machine with "make baseline"'.format(
+            args.baseline), file=sys.stderr)
+    elif args.baseline:
+        with open(args.baseline, 'rt') as baseline_fd:
+            regressions = compare_baseline(results, json.load(baseline_fd), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -32,9 +32,13 @@ This tool extracts a DNSKEY from a Certificate Signing Request as described
 in RFC 7958.
 """
 
-from typing import Tuple
+from typing import Callable, Dict, List, Tuple
 import sys
+import time
 import argparse
+import cProfile
+import functools
+import tracemalloc
 import re
 import logging
 import binascii
@@ -47,6 +51,9 @@ import Cryptodome.Util.number
 
 RR_OID = "1.3.6.1.4.1.1000.53"
 
+DEFAULT_PROFILE_TOP = 20
+PROFILED_FUNCTIONS = ['get_rsa_b64_from_der']
+
 
 def get_ds_rdata(x509name) -> Tuple[str, str]:
     """Get DS record from X509Name"""
@@ -108,6 +115,51 @@ def debug_hexlify(message: str, data: bytes, logger=logging) -> None:
     logger.debug("%s (%d bytes): %s", message, len(data), hexlifystr)
 
 
+def timed(function: Callable, timings: Dict[str, List[float]]) -> Callable:
+    """Wrap function to record its call durations in timings"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        """Record call duration"""
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.setdefault(function.__name__, []).append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_profiled(function: Callable, prefix: str, top: int) -> None:
+    """Run function under cProfile and tracemalloc, timing the hot functions"""
+    module = sys.modules[__name__]
+    timings = {}  # type: Dict[str, List[float]]
+    originals = {name: getattr(module, name) for name in PROFILED_FUNCTIONS}
+    for name, original in originals.items():
+        setattr(module, name, timed(original, timings))
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        profiler.runcall(function)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        for name, original in originals.items():
+            setattr(module, name, original)
+        profiler.dump_stats(prefix + '.pstats')
+        with open(prefix + '.alloc', 'w') as report_fd:
+            print('Peak traced memory: {} bytes'.format(peak), file=report_fd)
+            print('Top {} allocation sites:'.format(top), file=report_fd)
+            for stat in snapshot.statistics('lineno')[:top]:
+                print('  {}'.format(stat), file=report_fd)
+            print('Hot functions:', file=report_fd)
+            for name in PROFILED_FUNCTIONS:
+                durations = timings.get(name, [])
+                print('  {}: calls={} total={:.6f}s max={:.6f}s'.format(
+                    name, len(durations), sum(durations), max(durations, default=0)),
+                      file=report_fd)
+        print('Profile written to {0}.pstats and {0}.alloc'.format(prefix), file=sys.stderr)
+
+
 def main():
     """ Main function"""
     parser = argparse.ArgumentParser(description='csr2dnskey')
@@ -144,11 +196,30 @@ def main():
                           dest='output_ds',
                           action='store_false',
                           help="Don't output DS RR")
+    parser.add_argument('--profile',
+                        dest='profile',
+                        metavar='prefix',
+                        help="Write profile to prefix.pstats and prefix.alloc")
+    parser.add_argument('--profile-top',
+                        dest='profile_top',
+                        metavar='n',
+                        type=int,
+                        default=DEFAULT_PROFILE_TOP,
+                        help="Allocation sites in profile report")
     args = parser.parse_args()
 
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
+    if args.profile:
+        run_profiled(functools.partial(run, args), args.profile, args.profile_top)
+    else:
+        run(args)
+
+
+def run(args) -> None:
+    """Convert CSR with parsed arguments"""
+
     with open(args.csr, "rb") as csr_fd:
         csr = csr_fd.read()
 
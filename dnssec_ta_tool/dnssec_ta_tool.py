@@ -30,30 +30,133 @@ DNSSEC Trust Anchor Tool (dnssec_ta_tool.py)
 
 This tool will extract DNSSEC Trust Anchors from a Trust Anchor XML file
 formatted as described in RFC 7958. Validation of the detached signature
-over the Trust Anchor XML file is NOT performed by this tool.
+over the Trust Anchor XML file is NOT performed by this tool, unless the
+file is fetched with --fetch: the file and its signature are then downloaded
+over one kept-alive HTTPS connection and the signature is verified in memory
+against the ICANN Root CA (or --ca-file) before the file is parsed.
+
+Many zones can be refreshed across several nodes: --coordinate shards the
+trust anchor files in --anchors-dir by consistent hashing over the --node
+list and hands them out through a work queue (--queue, SQLite by default),
+--work NODE processes the zones of one node, and the coordinator reassigns
+the zones of nodes without a heartbeat before merging all results in zone
+order.
 """
 
+import io
+import os
+import abc
+import posixpath
+import re
 import sys
+import json
+import string
+import bisect
+import sqlite3
+import queue
+import mmap
+import functools
+import threading
+import cProfile
+import contextlib
+import tracemalloc
+import concurrent.futures
+import socket
+import ssl
+import subprocess
+import struct
+import http.client
+import urllib.parse
 import time
+import uuid
+import calendar
+import hashlib
+import tempfile
 import argparse
 import base64
 import iso8601
 import xmltodict
 import dns.dnssec
+import dns.flags
+import dns.message
 import dns.name
+import dns.query
 import dns.rdata
 import dns.rdataclass
 import dns.rdataset
 import dns.resolver
 import dns.rrset
+import dns.ttl
+import dns.zone
 
 DEFAULT_ANCHORS = 'root-anchors.xml'
+DEFAULT_ANCHORS_URL = 'https://data.iana.org/root-anchors/root-anchors.xml'
+DEFAULT_FETCH_TIMEOUT = 30.0
+DEFAULT_FLEET_JOBS = 8
+DEFAULT_QUORUM_BUDGET = 5.0
+DEFAULT_POOL_MAX_IDLE = 4
+DEFAULT_PROFILE_TOP = 20
+DEFAULT_WORKER_TIMEOUT = 30.0
+
+HASH_RING_VNODES = 64
+SHARD_CLAIM_BATCH = 16
+SHARD_POLL_INTERVAL = 0.2
+
+PROFILED_FUNCTIONS = ['get_trust_anchors_as_ds', 'dnskey_from_ds_rrset']
+
+# EDNS buffer size that avoids IP fragmentation (DNS flag day 2020), large
+# enough for DNSKEY RRsets during rollovers without falling back to TCP
+EDNS_PAYLOAD = 1232
+
+DNSKEY_PROVIDERS = ['resolver', 'zonefile:filename', 'rrset:filename', 'snapshot:filename']
+ZONEFILE_CLASSES = {'IN', 'CH', 'HS', 'CS'}
 
+FORMATS = ['ds', 'dnskey', 'bind-trusted', 'bind-managed', 'unbound']
 
-def get_trust_anchors_as_ds(zone, digests, verbose):
-    """Get currently valid Trust Anchors as DS RRset"""
+ICANN_ROOT_CA_CERT = '''
+-----BEGIN CERTIFICATE-----
+MIIDdzCCAl+gAwIBAgIBATANBgkqhkiG9w0BAQsFADBdMQ4wDAYDVQQKEwVJQ0FO
+TjEmMCQGA1UECxMdSUNBTk4gQ2VydGlmaWNhdGlvbiBBdXRob3JpdHkxFjAUBgNV
+BAMTDUlDQU5OIFJvb3QgQ0ExCzAJBgNVBAYTAlVTMB4XDTA5MTIyMzA0MTkxMloX
+DTI5MTIxODA0MTkxMlowXTEOMAwGA1UEChMFSUNBTk4xJjAkBgNVBAsTHUlDQU5O
+IENlcnRpZmljYXRpb24gQXV0aG9yaXR5MRYwFAYDVQQDEw1JQ0FOTiBSb290IENB
+MQswCQYDVQQGEwJVUzCCASIwDQYJKoZIhvcNAQEBBQADggEPADCCAQoCggEBAKDb
+cLhPNNqc1NB+u+oVvOnJESofYS9qub0/PXagmgr37pNublVThIzyLPGCJ8gPms9S
+G1TaKNIsMI7d+5IgMy3WyPEOECGIcfqEIktdR1YWfJufXcMReZwU4v/AdKzdOdfg
+ONiwc6r70duEr1IiqPbVm5T05l1e6D+HkAvHGnf1LtOPGs4CHQdpIUcy2kauAEy2
+paKcOcHASvbTHK7TbbvHGPB+7faAztABLoneErruEcumetcNfPMIjXKdv1V1E3C7
+MSJKy+jAqqQJqjZoQGB0necZgUMiUv7JK1IPQRM2CXJllcyJrm9WFxY0c1KjBO29
+iIKK69fcglKcBuFShUECAwEAAaNCMEAwDwYDVR0TAQH/BAUwAwEB/zAOBgNVHQ8B
+Af8EBAMCAf4wHQYDVR0OBBYEFLpS6UmDJIZSL8eZzfyNa2kITcBQMA0GCSqGSIb3
+DQEBCwUAA4IBAQAP8emCogqHny2UYFqywEuhLys7R9UKmYY4suzGO4nkbgfPFMfH
+6M+Zj6owwxlwueZt1j/IaCayoKU3QsrYYoDRolpILh+FPwx7wseUEV8ZKpWsoDoD
+2JFbLg2cfB8u/OlE4RYmcxxFSmXBg0yQ8/IoQt/bxOcEEhhiQ168H2yE5rxJMt9h
+15nu5JBSewrCkYqYYmaxyOC3WrVGfHZxVI7MpIFcGdvSb2a1uyuua8l0BKgk3ujF
+0/wsHNeP22qNyVO+XVBzrM8fk8BSUFuiT/6tZTYXRtEt5aKQZgXbKU5dUF3jT9qg
+j/Br5BZw3X/zd325TvnswzMC1+ljLzHnQGGk
+-----END CERTIFICATE-----
+'''
 
-    now = time.time()
+REPLAY_STATE_VERSION = 1
+REPLAY_TIMESTAMP_RE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})'
+                                 r'(?:[T_-]?(\d{2}):?(\d{2}):?(\d{2}))?')
+
+
+def parse_anchors(anchors_xml):
+    """Parse Trust Anchor XML, return zone and list of key digests"""
+    doc = xmltodict.parse(anchors_xml)
+    zone = doc['TrustAnchor']['Zone']
+    digests = doc['TrustAnchor']['KeyDigest']
+    if not isinstance(digests, list):
+        digests = [digests]
+    return (zone, digests)
+
+
+def get_trust_anchors_as_ds(zone, digests, verbose, now=None):
+    """Get Trust Anchors valid at now (default current time) as DS RRset"""
+
+    if now is None:
+        now = time.time()
     valid_ds_rdata = []
 
     for keydigest in digests:
@@ -103,16 +206,550 @@ def ds_digest_type_as_text(digest_type):
     return digest_types.get(digest_type)
 
 
-def dnskey_from_ds_rrset(ds_rrset, verbose):
+def resolve_dnskey_rrset(zone):
+    """Get DNSKEY RRset from the system resolver"""
+    resolver = dns.resolver.get_default_resolver()
+    resolver.use_edns(0, 0, EDNS_PAYLOAD)
+    return resolver.query(zone, 'DNSKEY').rrset
+
+
+def dnskey_rrset_from_response(zone, response):
+    """Get DNSKEY RRset from DNS response message"""
+    return response.find_rrset(response.answer, zone,
+                               dns.rdataclass.IN, dns.rdatatype.DNSKEY)
+
+
+class ConnectionPool:
+    """Idle connections kept open for reuse, keyed by destination"""
+
+    def __init__(self, connect, max_idle=DEFAULT_POOL_MAX_IDLE):
+        self.connect = connect
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.opened = 0
+
+    def acquire(self, key, timeout, fresh=False):
+        """Get (connection, reused) for key, opening a new one if none is idle"""
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle and not fresh:
+                return (idle.pop(), True)
+            self.opened += 1
+        return (self.connect(key, timeout), False)
+
+    def release(self, key, connection):
+        """Return connection to the pool, closing it if the pool is full"""
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """Close all idle connections"""
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+# Errors of a reused connection that the peer closed while it was idle. Any
+# other error (a timeout in particular) is not retried, as a retry would get
+# the whole timeout again.
+STALE_CONNECTION_ERRORS = (EOFError, ConnectionResetError, ConnectionAbortedError,
+                           BrokenPipeError, http.client.RemoteDisconnected,
+                           http.client.CannotSendRequest)
+
+
+def pooled_call(pool, key, timeout, function):
+    """Call function with a pooled connection, retrying once if a reused one was stale"""
+    (connection, reused) = pool.acquire(key, timeout)
+    try:
+        result = function(connection)
+    except STALE_CONNECTION_ERRORS:
+        connection.close()
+        if not reused:
+            raise
+        (connection, _) = pool.acquire(key, timeout, fresh=True)
+        try:
+            result = function(connection)
+        except BaseException:
+            connection.close()
+            raise
+    except BaseException:
+        connection.close()
+        raise
+    pool.release(key, connection)
+    return result
+
+
+def tcp_connect(key, timeout):
+    """Open TCP connection to (host, port)"""
+    sock = socket.create_connection(key, timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def http_connect(key, timeout, context=None):
+    """Open HTTP or HTTPS connection to (scheme, netloc)"""
+    (scheme, netloc) = key
+    if scheme == 'https':
+        return http.client.HTTPSConnection(netloc, timeout=timeout, context=context)
+    return http.client.HTTPConnection(netloc, timeout=timeout)
+
+
+TCP_POOL = ConnectionPool(tcp_connect)
+HTTP_POOL = ConnectionPool(http_connect)
+
+
+def recv_exactly(sock, length):
+    """Receive exactly length bytes from socket"""
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise EOFError('Connection closed by peer')
+        data.extend(chunk)
+    return bytes(data)
+
+
+def tcp_pipeline(sock, queries, timeout):
+    """Send all queries at once over TCP connection, return responses in query order"""
+    sock.settimeout(timeout)
+    sock.sendall(b''.join(struct.pack('!H', len(wire)) + wire
+                          for wire in (query.to_wire() for query in queries)))
+    # Responses may arrive in any order (RFC 7766), so match them by id
+    pending = {query.id: query for query in queries}
+    responses = {}
+    while pending:
+        (length,) = struct.unpack('!H', recv_exactly(sock, 2))
+        response = dns.message.from_wire(recv_exactly(sock, length))
+        query = pending.get(response.id)
+        if query is None or not query.is_response(response):
+            continue
+        responses[response.id] = response
+        del pending[response.id]
+    return [responses[query.id] for query in queries]
+
+
+def make_dnskey_queries(zones):
+    """Make DNSKEY queries with EDNS and distinct ids for zones"""
+    queries = []
+    query_ids = set()
+    for zone in zones:
+        query = dns.message.make_query(zone, dns.rdatatype.DNSKEY,
+                                       use_edns=0, payload=EDNS_PAYLOAD)
+        while query.id in query_ids:
+            query.id = (query.id + 1) & 0xFFFF
+        query_ids.add(query.id)
+        queries.append(query)
+    return queries
+
+
+def dnskey_queries_tcp(zones, host, port, timeout):
+    """Query DNSKEY RRsets for zones, pipelined over one pooled TCP connection"""
+    zones = [dns.name.from_text(zone) if isinstance(zone, str) else zone for zone in zones]
+    queries = make_dnskey_queries(zones)
+    responses = pooled_call(TCP_POOL, (host, port), timeout,
+                            lambda sock: tcp_pipeline(sock, queries, timeout))
+    return [dnskey_rrset_from_response(zone, response)
+            for (zone, response) in zip(zones, responses)]
+
+
+def dnskey_query_tcp(zone, host, port, timeout):
+    """Query DNSKEY RRset over pooled TCP"""
+    return dnskey_queries_tcp([zone], host, port, timeout)[0]
+
+
+def dnskey_query_udp(zone, host, port, timeout):
+    """Query DNSKEY RRset over UDP, retrying over pooled TCP if truncated"""
+    deadline = time.monotonic() + timeout
+    (query,) = make_dnskey_queries([zone])
+    response = dns.query.udp(query, host, port=port, timeout=timeout)
+    if response.flags & dns.flags.TC:
+        return dnskey_query_tcp(zone, host, port, max(deadline - time.monotonic(), 0))
+    return dnskey_rrset_from_response(zone, response)
+
+
+def doh_exchange(connection, path, wire):
+    """POST DNS query in wire format over kept-alive HTTP connection"""
+    connection.request('POST', path, body=wire,
+                       headers={'Content-Type': 'application/dns-message',
+                                'Accept': 'application/dns-message'})
+    response = connection.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise Exception('DNS-over-HTTPS status {}'.format(response.status))
+    return body
+
+
+def dnskey_query_doh(zone, url, timeout):
+    """Query DNSKEY RRset over DNS-over-HTTPS (RFC 8484) on a pooled connection"""
+    (query,) = make_dnskey_queries([zone])
+    query.id = 0
+    url_parts = urllib.parse.urlsplit(url)
+    path = url_parts.path or '/'
+    if url_parts.query:
+        path += '?' + url_parts.query
+    body = pooled_call(HTTP_POOL, (url_parts.scheme, url_parts.netloc), timeout,
+                       lambda connection: doh_exchange(connection, path, query.to_wire()))
+    return dnskey_rrset_from_response(zone, dns.message.from_wire(body))
+
+
+def http_get(connection, path):
+    """GET path over kept-alive HTTP connection"""
+    connection.request('GET', path)
+    response = connection.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise Exception('HTTP status {} for {}'.format(response.status, path))
+    return body
+
+
+def fetch_url(url, timeout, pool=HTTP_POOL):
+    """Get URL on a pooled connection, so requests to one server share it"""
+    url_parts = urllib.parse.urlsplit(url)
+    path = url_parts.path or '/'
+    if url_parts.query:
+        path += '?' + url_parts.query
+    return pooled_call(pool, (url_parts.scheme, url_parts.netloc), timeout,
+                       lambda connection: http_get(connection, path))
+
+
+def write_pipe(fd, data):
+    """Write data to pipe in a thread, closing it when done"""
+    def writer():
+        """Write and close"""
+        with os.fdopen(fd, 'wb') as pipe:
+            try:
+                pipe.write(data)
+            except BrokenPipeError:
+                pass
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    return thread
+
+
+@functools.lru_cache(maxsize=None)
+def openssl_no_castore():
+    """Get option to skip the default certificate store, if openssl has stores"""
+    usage = subprocess.run(['openssl', 'smime', '-help'], stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT, check=False).stdout
+    return ['-no-CAstore'] if b'-no-CAstore' in usage else []
+
+
+def verify_detached_signature(content, signature, ca_pem):
+    """Verify DER S/MIME detached signature over content against CA (PEM).
+    All three are passed to a single openssl process over pipes, never files.
+    Only the CA is trusted, never the default (system) certificate locations."""
+    (content_read, content_write) = os.pipe()
+    (ca_read, ca_write) = os.pipe()
+    command = ['openssl', 'smime', '-verify', '-inform', 'der',
+               '-content', '/dev/fd/{}'.format(content_read),
+               '-CAfile', '/dev/fd/{}'.format(ca_read),
+               '-no-CApath', '-no-CAfile'] + openssl_no_castore()
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   pass_fds=(content_read, ca_read))
+    except BaseException:
+        for fd in (content_write, ca_write):
+            os.close(fd)
+        raise
+    finally:
+        os.close(content_read)
+        os.close(ca_read)
+    writers = [write_pipe(content_write, content), write_pipe(ca_write, ca_pem)]
+    (_, stderr) = process.communicate(signature)
+    for writer in writers:
+        writer.join()
+    if process.returncode != 0:
+        raise Exception('Trust anchor signature verification failed: {}'.format(
+            stderr.decode(errors='replace').strip()))
+
+
+def signature_url_for(url):
+    """Get default detached signature URL for trust anchor file URL: the
+    extension of its path replaced with (or, without one, added) .p7s"""
+    parts = urllib.parse.urlsplit(url)
+    (root, extension) = posixpath.splitext(parts.path)
+    return urllib.parse.urlunsplit(parts._replace(path=(root if extension else parts.path) +
+                                                  '.p7s'))
+
+
+def fetch_verified_anchors(url, signature_url, ca_pem, timeout, tls_cafile=None, verbose=False):
+    """Fetch trust anchor file and its detached signature over one kept-alive
+    connection, return the trust anchor file once the signature is verified"""
+    if tls_cafile:
+        context = ssl.create_default_context(cafile=tls_cafile)
+        pool = ConnectionPool(functools.partial(http_connect, context=context))
+    else:
+        pool = HTTP_POOL
+    anchors_xml = fetch_url(url, timeout, pool)
+    signature = fetch_url(signature_url, timeout, pool)
+    if verbose:
+        emit_info('Fetched {} ({} bytes) and {} ({} bytes) over {} connection(s)'.format(
+            url, len(anchors_xml), signature_url, len(signature), pool.opened))
+    verify_detached_signature(anchors_xml, signature, ca_pem)
+    if verbose:
+        emit_info('Trust anchor signature verified')
+    return anchors_xml
+
+
+def scan_master_line(line):
+    """Drop comment and parentheses from master file line, return (text, change
+    in parenthesis depth), leaving quoted strings and escapes as they are"""
+    if b'"' not in line and b'\\' not in line:
+        text = line.split(b';', 1)[0]
+        return (text.replace(b'(', b' ').replace(b')', b' '),
+                text.count(b'(') - text.count(b')'))
+    (text, depth, quoted, index) = (bytearray(), 0, False, 0)
+    while index < len(line):
+        char = line[index:index + 1]
+        if char == b'\\':
+            text += line[index:index + 2]
+            index += 2
+            continue
+        if char == b'"':
+            quoted = not quoted
+        elif not quoted and char == b';':
+            break
+        elif not quoted and char in (b'(', b')'):
+            depth += 1 if char == b'(' else -1
+            char = b' '
+        text += char
+        index += 1
+    return (bytes(text), depth)
+
+
+def master_file_records(data):
+    """Yield (start, end, text) for each record in master file data (bytes or
+    mmap), joining parenthesized lines and dropping comments"""
+    (offset, size, depth) = (0, len(data), 0)
+    (record_start, parts) = (0, [])
+    while offset < size:
+        end = data.find(b'\n', offset)
+        end = size if end < 0 else end + 1
+        (text, change) = scan_master_line(data[offset:end])
+        if depth == 0:
+            (record_start, parts) = (offset, [])
+        parts.append(text.rstrip(b'\r\n'))
+        depth += change
+        offset = end
+        if depth <= 0:
+            depth = 0
+            yield (record_start, end, b' '.join(parts).decode())
+
+
+def split_master_record(text, origin, owner, default_ttl):
+    """Split master file record text into (owner, ttl, type, rdata tokens),
+    the owner carrying over from the previous record if not given"""
+    tokens = text.split()
+    if not text[:1].isspace():
+        owner = dns.name.from_text(tokens.pop(0), origin)
+    ttl = default_ttl
+    for _ in range(2):
+        if tokens and tokens[0].upper() in ZONEFILE_CLASSES:
+            tokens.pop(0)
+        elif tokens and tokens[0][:1].isdigit():
+            ttl = dns.ttl.from_text(tokens.pop(0))
+    rdtype = tokens.pop(0).upper() if tokens else None
+    return (owner, ttl, rdtype, tokens)
+
+
+def read_master_dnskeys(data):
+    """Yield (owner, ttl, start, end) for each DNSKEY record in master file data"""
+    (origin, owner, default_ttl) = (dns.name.root, None, 0)
+    for (start, end, text) in master_file_records(data):
+        if not text.strip():
+            continue
+        if text.startswith('$'):
+            (directive, value) = (text.split() + [''])[0:2]
+            if directive.upper() == '$ORIGIN':
+                origin = dns.name.from_text(value, origin)
+            elif directive.upper() == '$TTL':
+                default_ttl = dns.ttl.from_text(value)
+            continue
+        (owner, ttl, rdtype, _) = split_master_record(text, origin, owner, default_ttl)
+        if rdtype == 'DNSKEY':
+            yield (owner, ttl, start, end)
+
+
+def dnskey_rdata_from_record(text):
+    """Parse DNSKEY rdata from master file record text"""
+    (_, _, _, tokens) = split_master_record(text, dns.name.root, dns.name.root, 0)
+    return dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.DNSKEY, ' '.join(tokens))
+
+
+class ZoneFileIndex:
+    """DNSKEY records of a zone file, indexed by owner name when first loaded
+    and then parsed from a memory map of the file on each lookup"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {}
+        with open(filename, 'rb') as zone_fd:
+            if os.fstat(zone_fd.fileno()).st_size == 0:
+                self.mapped = b''
+            else:
+                self.mapped = mmap.mmap(zone_fd.fileno(), 0, access=mmap.ACCESS_READ)
+        for (owner, ttl, start, end) in read_master_dnskeys(self.mapped):
+            self.index.setdefault(owner, []).append((ttl, start, end))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap the zone file"""
+        if isinstance(self.mapped, mmap.mmap):
+            self.mapped.close()
+        self.mapped = b''
+        self.index = {}
+
+    def dnskey_rrset(self, zone):
+        """Get DNSKEY RRset of zone"""
+        zone = dns.name.from_text(zone) if isinstance(zone, str) else zone
+        spans = self.index.get(zone)
+        if not spans:
+            raise Exception('No DNSKEY RRset for {} in {}'.format(zone, self.filename))
+        rdatas = []
+        for (_, start, end) in spans:
+            for (_, _, text) in master_file_records(self.mapped[start:end]):
+                rdatas.append(dnskey_rdata_from_record(text))
+        return dns.rrset.from_rdata_list(zone, min(ttl for (ttl, _, _) in spans), rdatas)
+
+
+DNSKEY_PROVIDER_RESOURCES = contextlib.ExitStack()
+
+
+@functools.lru_cache(maxsize=None)
+def zonefile_index(filename):
+    """Get DNSKEY index of zone file, built on first use and kept open until
+    close_dnskey_providers()"""
+    return DNSKEY_PROVIDER_RESOURCES.enter_context(ZoneFileIndex(filename))
+
+
+def close_dnskey_providers():
+    """Close zone file indexes opened by DNSKEY providers"""
+    DNSKEY_PROVIDER_RESOURCES.close()
+    zonefile_index.cache_clear()
+
+
+def dnskey_from_zonefile(zone, filename):
+    """Get DNSKEY RRset from zone file"""
+    return zonefile_index(filename).dnskey_rrset(zone)
+
+
+def dnskey_from_rrset_file(zone, filename):
+    """Get DNSKEY RRset from a file with DNSKEY records in master file format"""
+    with open(filename, 'rb') as rrset_fd:
+        data = rrset_fd.read()
+    zone = dns.name.from_text(zone) if isinstance(zone, str) else zone
+    records = [(ttl, data[start:end]) for (owner, ttl, start, end)
+               in read_master_dnskeys(data) if owner == zone]
+    if not records:
+        raise Exception('No DNSKEY RRset for {} in {}'.format(zone, filename))
+    rdatas = [dnskey_rdata_from_record(text) for (_, record) in records
+              for (_, _, text) in master_file_records(record)]
+    return dns.rrset.from_rdata_list(zone, min(ttl for (ttl, _) in records), rdatas)
+
+
+def dnskey_from_snapshot(zone, filename):
+    """Get DNSKEY RRset from a snapshot (dnskey output of an earlier run)"""
+    zone = dns.name.from_text(zone) if isinstance(zone, str) else zone
+    with open(filename, 'rt') as snapshot_fd:
+        dnskeys = read_dnskey_snapshot(snapshot_fd.read(), zone=zone)
+    if not dnskeys:
+        raise Exception('No DNSKEY records for {} in snapshot {}'.format(zone, filename))
+    return dns.rrset.from_rdata_list(zone, 0, dnskeys)
+
+
+def dnskey_provider(provider):
+    """Get DNSKEY fetch function for provider (resolver, zonefile:filename,
+    rrset:filename or snapshot:filename)"""
+    (name, _, filename) = provider.partition(':')
+    if name == 'resolver' and not filename:
+        return resolve_dnskey_rrset
+    if name == 'zonefile' and filename:
+        zonefile_index(filename)
+        return functools.partial(dnskey_from_zonefile, filename=filename)
+    if name == 'rrset' and filename:
+        return functools.partial(dnskey_from_rrset_file, filename=filename)
+    if name == 'snapshot' and filename:
+        return functools.partial(dnskey_from_snapshot, filename=filename)
+    raise Exception('Invalid DNSKEY provider {}'.format(provider))
+
+
+def dnskey_query_source(zone, source, timeout):
+    """Get DNSKEY RRset from source (udp://, tcp://, https://, http:// or file:)"""
+    url = urllib.parse.urlsplit(source)
+    if url.scheme == 'udp':
+        return dnskey_query_udp(zone, url.hostname, url.port or 53, timeout)
+    if url.scheme == 'tcp':
+        return dnskey_query_tcp(zone, url.hostname, url.port or 53, timeout)
+    if url.scheme in ('https', 'http'):
+        return dnskey_query_doh(zone, source, timeout)
+    if url.scheme == 'file':
+        return dnskey_from_zonefile(zone, url.path)
+    raise Exception('Invalid DNSKEY source {}'.format(source))
+
+
+def fetch_dnskey_quorum(zone, sources, quorum, budget, verbose):
+    """Query all sources concurrently, return the DNSKEY RRset once quorum sources agree"""
+    deadline = time.monotonic() + budget
+    results = queue.Queue()
+
+    def query_source(source):
+        """Query one source, queueing its answer or failure"""
+        try:
+            timeout = max(deadline - time.monotonic(), 0)
+            results.put((source, dnskey_query_source(zone, source, timeout), None))
+        except Exception as exc:  # pylint: disable=broad-except
+            results.put((source, None, exc))
+
+    # Queries run in daemon threads, so any still outstanding when quorum is
+    # reached or the budget runs out are abandoned rather than waited for.
+    for source in sources:
+        threading.Thread(target=query_source, args=(source,), daemon=True).start()
+
+    votes = {}
+    for _ in sources:
+        try:
+            (source, rrset, exc) = results.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            if verbose:
+                emit_warning('DNSKEY query budget of {}s exhausted'.format(budget))
+            break
+        if exc is not None:
+            if verbose:
+                emit_warning('DNSKEY source {} failed: {}'.format(source, exc))
+            continue
+        key = frozenset(rdata.to_digestable() for rdata in rrset)
+        votes.setdefault(key, []).append(source)
+        if verbose:
+            emit_info('DNSKEY source {} answered ({} agree)'.format(source, len(votes[key])))
+        if len(votes[key]) >= quorum:
+            return rrset
+    raise Exception('DNSKEY quorum of {} not reached for {}'.format(quorum, zone))
+
+
+def dnskey_from_ds_rrset(ds_rrset, verbose, fetch_dnskey=resolve_dnskey_rrset):
     """Match current DNSKEY RRset with DS RRset"""
     zone = ds_rrset.name
     dnskey_rrset = dns.rrset.RRset(name=zone,
                                    rdclass=dns.rdataclass.IN,
                                    rdtype=dns.rdatatype.DNSKEY)
 
-    answer = dns.resolver.query(zone, 'DNSKEY')
+    answer_rrset = fetch_dnskey(zone)
 
-    for answer_rr in answer.rrset:
+    for answer_rr in answer_rrset:
         if answer_rr.rdtype != dns.rdatatype.DNSKEY:
             continue
         if not answer_rr.flags & 0x0001:
@@ -189,10 +826,711 @@ def print_dnskey_rrset_without_ttl(dnskey_rrset):
                                              base64.b64encode(dnskey_rr.key).decode()))
 
 
+def print_unbound_anchors(ds_rrset):
+    """Print DS RRset as zone file anchors (unbound/knot trust anchor file)"""
+    for ds_rr in ds_rrset:
+        print('{} IN DS {}'.format(ds_rrset.name, ds_rr.to_text()))
+
+
+def print_anchors(output_format, ds_rrset, dnskey_rrset):
+    """Print trust anchors in output format"""
+    if output_format == 'ds':
+        print_ds_rrset_without_ttl(ds_rrset)
+    elif output_format == 'dnskey':
+        print_dnskey_rrset_without_ttl(dnskey_rrset)
+    elif output_format == 'bind-trusted':
+        bind_trusted_keys(dnskey_rrset)
+    elif output_format == 'bind-managed':
+        bind_managed_keys(dnskey_rrset)
+    elif output_format == 'unbound':
+        print_unbound_anchors(ds_rrset)
+    else:
+        raise Exception('Invalid output format')
+
+
+def render_anchors(output_format, ds_rrset, dnskey_rrset):
+    """Render trust anchors in output format as bytes"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        print_anchors(output_format, ds_rrset, dnskey_rrset)
+    return output.getvalue().encode()
+
+
+def load_fleet_manifest(manifest_filename):
+    """Load host manifest (JSON object of host to format, path and template)"""
+    with open(manifest_filename, 'rt') as manifest_fd:
+        manifest = json.load(manifest_fd)
+    base_dir = os.path.dirname(os.path.abspath(manifest_filename))
+    hosts = {}
+    for (host, entry) in sorted(manifest.items()):
+        if entry.get('format', 'ds') not in FORMATS:
+            raise Exception('Invalid output format for host {}'.format(host))
+        if 'path' not in entry:
+            raise Exception('No output path for host {}'.format(host))
+        template = entry.get('template')
+        hosts[host] = {
+            'format': entry.get('format', 'ds'),
+            'path': os.path.join(base_dir, entry['path']),
+            'template': os.path.join(base_dir, template) if template else None
+        }
+    return hosts
+
+
+def write_if_changed(filename, contents):
+    """Atomically replace file with contents, unless unchanged"""
+    try:
+        with open(filename, 'rb') as file_fd:
+            if file_fd.read() == contents:
+                return False
+    except FileNotFoundError:
+        pass
+    file_dir = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(file_dir, exist_ok=True)
+    (file_fd, temp_filename) = tempfile.mkstemp(dir=file_dir, prefix='.tmp-')
+    try:
+        with os.fdopen(file_fd, 'wb') as temp_fd:
+            temp_fd.write(contents)
+        os.chmod(temp_filename, 0o644)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.unlink(temp_filename)
+        raise
+    return True
+
+
+def render_fleet(hosts, ds_rrset, dnskey_rrset, jobs, verbose):
+    """Render and write per-host output, each distinct format rendered once"""
+    rendered = {}
+    templates = {}
+    outputs = {}
+    for (host, entry) in hosts.items():
+        if entry['format'] not in rendered:
+            rendered[entry['format']] = render_anchors(entry['format'],
+                                                       ds_rrset, dnskey_rrset)
+        contents = rendered[entry['format']]
+        if entry['template']:
+            if entry['template'] not in templates:
+                with open(entry['template'], 'rt') as template_fd:
+                    templates[entry['template']] = string.Template(template_fd.read())
+            contents = templates[entry['template']].substitute(
+                host=host, anchors=contents.decode()).encode()
+        outputs[host] = (entry['path'], contents)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {host: executor.submit(write_if_changed, path, contents)
+                   for (host, (path, contents)) in outputs.items()}
+    changed = 0
+    for (host, future) in sorted(futures.items()):
+        if future.result():
+            changed += 1
+            if verbose:
+                emit_info('{} written to {}'.format(host, outputs[host][0]))
+    if verbose:
+        emit_info('{} of {} host files written, {} formats rendered'.format(
+            changed, len(outputs), len(rendered)))
+    return changed
+
+
+class HashRing:
+    """Consistent hash ring of nodes, so removing a node only moves its own zones"""
+
+    def __init__(self, nodes, vnodes=HASH_RING_VNODES):
+        self.points = sorted((self.hash('{}#{}'.format(node, index)), node)
+                             for node in set(nodes) for index in range(vnodes))
+        self.keys = [point for (point, _) in self.points]
+
+    @staticmethod
+    def hash(text):
+        """Position of text on the ring"""
+        return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'big')
+
+    def node_for(self, zone):
+        """Get node owning zone"""
+        if not self.points:
+            raise Exception('No nodes in hash ring')
+        index = bisect.bisect(self.keys, self.hash(str(zone).lower()))
+        return self.points[index % len(self.points)][1]
+
+
+class WorkQueue(abc.ABC):
+    """Work queue between a coordinator and its workers. Tasks are zones with
+    their trust anchor file, each assigned to a node; workers claim their own
+    tasks and complete them with a result or an error. Each run of the
+    coordinator has its own id in the settings, and is marked finished when
+    all its tasks are done."""
+
+    @abc.abstractmethod
+    def start(self, tasks, settings):
+        """Replace all tasks with (zone, anchors, node) tuples, then publish settings"""
+
+    @abc.abstractmethod
+    def finish(self):
+        """Mark the current run finished, so its workers exit"""
+
+    @abc.abstractmethod
+    def settings(self):
+        """Get published settings (empty until the coordinator has started)"""
+
+    @abc.abstractmethod
+    def claim(self, node, count):
+        """Claim up to count pending tasks of node, return (zone, anchors) tuples"""
+
+    @abc.abstractmethod
+    def complete(self, node, zone, result=None, error=None):
+        """Store result or error of task, unless it was reassigned from node"""
+
+    @abc.abstractmethod
+    def heartbeat(self, node):
+        """Record that node is alive"""
+
+    @abc.abstractmethod
+    def heartbeats(self):
+        """Get dict of node to time of its last heartbeat"""
+
+    @abc.abstractmethod
+    def unfinished(self):
+        """Get (zone, node) tuples of tasks not yet completed"""
+
+    @abc.abstractmethod
+    def reassign(self, zone, node):
+        """Hand an unfinished task to another node"""
+
+    @abc.abstractmethod
+    def results(self):
+        """Get (zone, result, error) tuples of all completed tasks"""
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue in an SQLite database, shared by processes on one host or
+    over a shared file system"""
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tasks (zone TEXT PRIMARY KEY, '
+                        'anchors TEXT, node TEXT, state TEXT, result TEXT, error TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, '
+                        'heartbeat REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, '
+                        'value TEXT)')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run statements in a write transaction"""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def start(self, tasks, settings):
+        with self.transaction() as db:
+            db.execute('DELETE FROM tasks')
+            db.execute('DELETE FROM settings')
+            db.executemany('INSERT INTO tasks VALUES (?, ?, ?, ?, NULL, NULL)',
+                           [(zone, anchors, node, 'pending') for (zone, anchors, node) in tasks])
+            db.executemany('INSERT INTO settings VALUES (?, ?)', sorted(settings.items()))
+
+    def finish(self):
+        with self.transaction() as db:
+            db.execute('INSERT OR REPLACE INTO settings SELECT ?, value FROM settings '
+                       'WHERE key = ?', ('finished', 'run'))
+
+    def settings(self):
+        return dict(self.db.execute('SELECT key, value FROM settings'))
+
+    def claim(self, node, count):
+        with self.transaction() as db:
+            tasks = db.execute('SELECT zone, anchors FROM tasks WHERE node = ? AND '
+                               'state = ? ORDER BY zone LIMIT ?',
+                               (node, 'pending', count)).fetchall()
+            db.executemany('UPDATE tasks SET state = ? WHERE zone = ?',
+                           [('claimed', zone) for (zone, _) in tasks])
+        return tasks
+
+    def complete(self, node, zone, result=None, error=None):
+        with self.transaction() as db:
+            db.execute('UPDATE tasks SET state = ?, result = ?, error = ? '
+                       'WHERE zone = ? AND node = ? AND state = ?',
+                       ('done', json.dumps(result) if result is not None else None,
+                        error, zone, node, 'claimed'))
+
+    def heartbeat(self, node):
+        with self.transaction() as db:
+            db.execute('INSERT OR REPLACE INTO nodes VALUES (?, ?)', (node, time.time()))
+
+    def heartbeats(self):
+        return dict(self.db.execute('SELECT node, heartbeat FROM nodes'))
+
+    def unfinished(self):
+        return self.db.execute('SELECT zone, node FROM tasks WHERE state != ? ORDER BY zone',
+                               ('done',)).fetchall()
+
+    def reassign(self, zone, node):
+        with self.transaction() as db:
+            db.execute('UPDATE tasks SET node = ?, state = ? WHERE zone = ? AND state != ?',
+                       (node, 'pending', zone, 'done'))
+
+    def results(self):
+        return [(zone, json.loads(result) if result is not None else None, error)
+                for (zone, result, error) in self.db.execute(
+                    'SELECT zone, result, error FROM tasks WHERE state = ?', ('done',))]
+
+
+WORK_QUEUES = {'sqlite': SQLiteWorkQueue}
+
+
+def open_work_queue(queue_spec):
+    """Open work queue (sqlite:filename, or just a filename for SQLite)"""
+    (name, sep, argument) = queue_spec.partition(':')
+    if not sep:
+        return SQLiteWorkQueue(queue_spec)
+    if name not in WORK_QUEUES:
+        raise Exception('Invalid work queue {} (known types: {})'.format(
+            queue_spec, ', '.join(sorted(WORK_QUEUES))))
+    return WORK_QUEUES[name](argument)
+
+
+def load_anchors_dir(anchors_dir):
+    """Read all trust anchor files (*.xml) in directory, return dict of zone to file text"""
+    anchors = {}
+    for filename in sorted(os.listdir(anchors_dir)):
+        if not filename.endswith('.xml'):
+            continue
+        with open(os.path.join(anchors_dir, filename), 'rt') as anchors_fd:
+            anchors_xml = anchors_fd.read()
+        (zone, _) = parse_anchors(anchors_xml)
+        zone = dns.name.from_text(zone).to_text()
+        if zone in anchors:
+            raise Exception('Zone {} in more than one trust anchor file'.format(zone))
+        anchors[zone] = anchors_xml
+    return anchors
+
+
+def refresh_zone(anchors_xml, output_format, fetch_dnskey, verbose):
+    """Get DS (and, if output format needs it, DNSKEY) rdata texts for one zone"""
+    (zone, digests) = parse_anchors(anchors_xml)
+    ds_rrset = get_trust_anchors_as_ds(zone, digests, verbose=verbose)
+    result = {'ds': sorted(rdata.to_text() for rdata in ds_rrset), 'dnskey': []}
+    if output_format not in ('ds', 'unbound'):
+        dnskey_rrset = dnskey_from_ds_rrset(ds_rrset, verbose=verbose, fetch_dnskey=fetch_dnskey)
+        result['dnskey'] = sorted(rdata.to_text() for rdata in dnskey_rrset)
+    return result
+
+
+def run_worker(work_queue, node, fetch_dnskey, verbose):
+    """Refresh zones assigned to node until the coordinator finishes its run.
+    A run already finished when the worker starts is left over in a reused
+    queue, so the worker waits for the next run instead"""
+    completed = 0
+    stale_run = work_queue.settings().get('finished')
+    while True:
+        work_queue.heartbeat(node)
+        settings = work_queue.settings()
+        run_id = settings.get('run')
+        current = run_id is not None and run_id != stale_run
+        if current and settings.get('finished') == run_id:
+            break
+        tasks = work_queue.claim(node, SHARD_CLAIM_BATCH) if current else []
+        for (zone, anchors_xml) in tasks:
+            try:
+                result = refresh_zone(anchors_xml, settings['format'], fetch_dnskey, verbose)
+                work_queue.complete(node, zone, result=result)
+            except Exception as exc:  # pylint: disable=broad-except
+                if verbose:
+                    emit_warning('Zone {} failed: {}'.format(zone, exc))
+                work_queue.complete(node, zone, error=str(exc))
+            completed += 1
+            work_queue.heartbeat(node)
+        if not tasks:
+            time.sleep(SHARD_POLL_INTERVAL)
+    if verbose:
+        emit_info('Worker {} completed {} zones'.format(node, completed))
+    return completed
+
+
+def coordinate(work_queue, anchors, nodes, output_format, worker_timeout, verbose):
+    """Shard zones across nodes, wait for the workers, reassigning the zones
+    of nodes without a heartbeat within worker_timeout, return results.
+    The run is marked finished even if it fails, so the workers exit"""
+    ring = HashRing(nodes)
+    work_queue.start([(zone, anchors_xml, ring.node_for(zone))
+                      for (zone, anchors_xml) in sorted(anchors.items())],
+                     {'format': output_format, 'run': uuid.uuid4().hex})
+    if verbose:
+        emit_info('{} zones sharded across {} nodes'.format(len(anchors), len(set(nodes))))
+    try:
+        return wait_for_workers(work_queue, nodes, worker_timeout, verbose)
+    finally:
+        work_queue.finish()
+
+
+def wait_for_workers(work_queue, nodes, worker_timeout, verbose):
+    """Wait until every task is done, reassigning the zones of nodes without
+    a heartbeat within worker_timeout, return results"""
+    started = time.time()
+    live = set(nodes)
+    while True:
+        unfinished = work_queue.unfinished()
+        if not unfinished:
+            break
+        now = time.time()
+        heartbeats = work_queue.heartbeats()
+        dead = {node for node in live
+                if now - max(heartbeats.get(node, 0), started) > worker_timeout}
+        if dead:
+            live -= dead
+            if not live:
+                raise Exception('No live workers left')
+            ring = HashRing(live)
+            moved = 0
+            for (zone, node) in unfinished:
+                if node in dead:
+                    work_queue.reassign(zone, ring.node_for(zone))
+                    moved += 1
+            if verbose:
+                emit_warning('Workers {} dead, {} zones reassigned'.format(
+                    ', '.join(sorted(dead)), moved))
+        time.sleep(SHARD_POLL_INTERVAL)
+    return work_queue.results()
+
+
+def merge_results(results, output_format, verbose):
+    """Render results of all zones, in canonical zone order, as one output,
+    return (output, number of failed zones)"""
+    (output, failures) = ([], 0)
+    for (zone, result, error) in sorted(results, key=lambda entry: dns.name.from_text(entry[0])):
+        if error is not None:
+            emit_warning('Zone {} failed: {}'.format(zone, error))
+            failures += 1
+            continue
+        ds_rrset = dns.rrset.from_text_list(zone, 0, dns.rdataclass.IN, dns.rdatatype.DS,
+                                            result['ds'])
+        dnskey_rrset = dns.rrset.from_text_list(zone, 0, dns.rdataclass.IN,
+                                                dns.rdatatype.DNSKEY, result['dnskey'])
+        output.append(render_anchors(output_format, ds_rrset, dnskey_rrset).decode())
+    if verbose:
+        emit_info('{} zones merged'.format(len(output)))
+    return (''.join(output), failures)
+
+
+def read_dnskey_snapshot(snapshot_text, zone=None):
+    """Read DNSKEY records (as printed by the dnskey format) from text, only
+    those owned by zone if given"""
+    dnskeys = []
+    for line in snapshot_text.splitlines():
+        tokens = line.split()
+        if 'DNSKEY' not in tokens:
+            continue
+        if zone is not None and (tokens.index('DNSKEY') == 0 or
+                                 dns.name.from_text(tokens[0]) != zone):
+            continue
+        rdata_text = ' '.join(tokens[tokens.index('DNSKEY') + 1:])
+        dnskeys.append(dns.rdata.from_text(dns.rdataclass.IN,
+                                           dns.rdatatype.DNSKEY,
+                                           rdata_text))
+    return dnskeys
+
+
+def match_dnskey_snapshot(zone, digests, dnskeys):
+    """Return list of (DS, DNSKEY) texts for snapshot keys matching digests"""
+    matches = []
+    for keydigest in digests:
+        ds_rdata = ds_rdata_from_keydigest(keydigest)
+        ds_algo = ds_digest_type_as_text(ds_rdata.digest_type)
+        for dnskey_rdata in dnskeys:
+            dnskey_as_ds = dns.dnssec.make_ds(name=zone,
+                                              key=dnskey_rdata,
+                                              algorithm=ds_algo)
+            if dnskey_as_ds == ds_rdata:
+                dnskey_text = '{} {} {} {}'.format(dnskey_rdata.flags,
+                                                   dnskey_rdata.protocol,
+                                                   dnskey_rdata.algorithm,
+                                                   base64.b64encode(dnskey_rdata.key).decode())
+                matches.append((ds_rdata.to_text(), dnskey_text))
+    return matches
+
+
+def archive_timestamp(filename, mtime):
+    """Get archive entry time from its file name (UTC), or else its mtime"""
+    match = REPLAY_TIMESTAMP_RE.search(os.path.basename(filename))
+    if match:
+        fields = [int(value) for value in match.groups(default='0')]
+        try:
+            return calendar.timegm(tuple(fields) + (0, 0, 0))
+        except ValueError:
+            pass
+    return int(mtime)
+
+
+def format_timestamp(timestamp):
+    """Format timestamp as ISO 8601 UTC"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def sha256_file(filename):
+    """Return SHA-256 hex digest of file contents, or None if missing"""
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as file_fd:
+        return hashlib.sha256(file_fd.read()).hexdigest()
+
+
+def load_replay_state(state_filename):
+    """Load replay state, or return an empty state"""
+    state = {'version': REPLAY_STATE_VERSION,
+             'files': {}, 'documents': {}, 'snapshots': {},
+             'entries': [], 'log': []}
+    if state_filename and os.path.exists(state_filename):
+        with open(state_filename, 'rt') as state_fd:
+            saved_state = json.load(state_fd)
+        if saved_state.get('version') == REPLAY_STATE_VERSION:
+            state.update(saved_state)
+    return state
+
+
+def save_replay_state(state_filename, state):
+    """Atomically save replay state"""
+    state_dir = os.path.dirname(os.path.abspath(state_filename))
+    (state_fd, temp_filename) = tempfile.mkstemp(dir=state_dir,
+                                                 prefix='.replay-')
+    with os.fdopen(state_fd, 'wt') as temp_fd:
+        json.dump(state, temp_fd, sort_keys=True)
+    os.replace(temp_filename, state_filename)
+
+
+def hash_archive_file(state, filename, seen_files):
+    """Return content hash of archive file, rehashing only if it changed"""
+    if not os.path.exists(filename):
+        return None
+    stat = os.stat(filename)
+    seen_files.add(filename)
+    cached = state['files'].get(filename)
+    if cached and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+        return cached['sha256']
+    content_hash = sha256_file(filename)
+    state['files'][filename] = {'mtime': stat.st_mtime,
+                                'size': stat.st_size,
+                                'sha256': content_hash}
+    return content_hash
+
+
+def scan_archive(archive_dir, state, verbose):
+    """Scan archive, parsing only documents and snapshots not seen before"""
+    entries = []
+    seen_files = set()
+    for (dirpath, _, filenames) in os.walk(archive_dir):
+        for filename in sorted(filenames):
+            if not filename.endswith('.xml'):
+                continue
+            anchors_filename = os.path.join(dirpath, filename)
+            basename = anchors_filename[:-len('.xml')]
+            doc_hash = hash_archive_file(state, anchors_filename, seen_files)
+            sig_hash = hash_archive_file(state, basename + '.p7s', seen_files)
+            key_hash = hash_archive_file(state, basename + '.dnskey', seen_files)
+
+            if doc_hash not in state['documents']:
+                if verbose:
+                    emit_info('Parsing {}'.format(anchors_filename))
+                with open(anchors_filename, 'rt') as anchors_fd:
+                    (zone, digests) = parse_anchors(anchors_fd.read())
+                state['documents'][doc_hash] = {'zone': zone, 'digests': digests}
+
+            snapshot_id = None
+            if key_hash is not None:
+                snapshot_id = '{}:{}'.format(doc_hash, key_hash)
+                if snapshot_id not in state['snapshots']:
+                    if verbose:
+                        emit_info('Matching {}.dnskey'.format(basename))
+                    document = state['documents'][doc_hash]
+                    with open(basename + '.dnskey', 'rt') as snapshot_fd:
+                        dnskeys = read_dnskey_snapshot(snapshot_fd.read())
+                    state['snapshots'][snapshot_id] = match_dnskey_snapshot(
+                        dns.name.from_text(document['zone']),
+                        document['digests'], dnskeys)
+
+            mtime = state['files'][anchors_filename]['mtime']
+            entries.append({'time': archive_timestamp(anchors_filename, mtime),
+                            'path': os.path.relpath(anchors_filename, archive_dir),
+                            'document': doc_hash,
+                            'signature': sig_hash,
+                            'snapshot': snapshot_id})
+
+    entries.sort(key=lambda entry: (entry['time'], entry['path']))
+
+    # Forget files that have been removed from the archive
+    for filename in set(state['files']) - seen_files:
+        del state['files'][filename]
+    return entries
+
+
+def replay_event_times(document, start, end):
+    """Return times in [start, end) where validity in document may change"""
+    times = {start}
+    for keydigest in document['digests']:
+        for attribute in ['@validFrom', '@validUntil']:
+            if attribute in keydigest:
+                boundary = iso8601.parse_date(keydigest[attribute]).timestamp()
+                # Expiry is strict, so the anchor is still valid at the boundary
+                if attribute == '@validUntil':
+                    boundary = int(boundary) + 1
+                if start < boundary < end:
+                    times.add(int(boundary))
+    return sorted(times)
+
+
+def replay_entries(state, entries, start, trusted, now):
+    """Replay archive entries from start onwards, return change log records"""
+    log = []
+    (trusted_ds, trusted_dnskey) = trusted
+    for index in range(start, len(entries)):
+        entry = entries[index]
+        document = state['documents'][entry['document']]
+        zone = document['zone']
+        if index + 1 < len(entries):
+            end = entries[index + 1]['time']
+        else:
+            end = max(now, entry['time'] + 1)
+        log.append([entry['time'], 'archive', entry['path'],
+                    entry['document'], entry['signature'] or '-'])
+
+        # Entries without a DNSKEY snapshot use the most recent one
+        matches = []
+        for previous in reversed(entries[:index + 1]):
+            if previous['snapshot'] is not None:
+                matches = state['snapshots'][previous['snapshot']]
+                break
+
+        for event_time in replay_event_times(document, entry['time'], end):
+            ds_rrset = get_trust_anchors_as_ds(zone, document['digests'],
+                                               verbose=False, now=event_time)
+            valid_ds = {'{} DS {}'.format(zone, rdata.to_text()) for rdata in ds_rrset}
+            valid_dnskey = {'{} DNSKEY {}'.format(zone, dnskey_text)
+                            for (ds_text, dnskey_text) in matches
+                            if '{} DS {}'.format(zone, ds_text) in valid_ds}
+            for record in sorted(trusted_ds - valid_ds) + sorted(trusted_dnskey - valid_dnskey):
+                log.append([event_time, '-', record])
+            for record in sorted(valid_ds - trusted_ds) + sorted(valid_dnskey - trusted_dnskey):
+                log.append([event_time, '+', record])
+            (trusted_ds, trusted_dnskey) = (valid_ds, valid_dnskey)
+    return log
+
+
+def replay_archive(archive_dir, state_filename, verbose):
+    """Replay archived Trust Anchor files, return time-indexed change log"""
+    state = load_replay_state(state_filename)
+    entries = scan_archive(archive_dir, state, verbose)
+
+    # The change log is reused up to the last archive entry that is unchanged
+    # since the previous run, as only that entry and later ones are affected.
+    def entry_key(entry):
+        return (entry['time'], entry['path'], entry['document'], entry['signature'],
+                entry['snapshot'])
+    common = 0
+    while (common < min(len(entries), len(state['entries'])) and
+           entry_key(entries[common]) == entry_key(state['entries'][common])):
+        common += 1
+    start = max(common - 1, 0)
+    archive_records = [index for (index, record) in enumerate(state['log'])
+                       if record[1] == 'archive']
+    if start < len(archive_records):
+        log = state['log'][:archive_records[start]]
+    else:
+        log = []
+
+    trusted = (set(), set())
+    for (_, change, record) in (record[:3] for record in log):
+        if change in ('+', '-'):
+            target = trusted[1] if ' DNSKEY ' in record else trusted[0]
+            if change == '+':
+                target.add(record)
+            else:
+                target.discard(record)
+    if verbose:
+        emit_info('Replaying {} of {} archive entries'.format(len(entries) - start,
+                                                               len(entries)))
+    log += replay_entries(state, entries, start, trusted, int(time.time()))
+
+    # Drop cached results no longer referenced by the archive
+    documents = {entry['document'] for entry in entries}
+    snapshots = {entry['snapshot'] for entry in entries}
+    state['documents'] = {key: value for (key, value) in state['documents'].items()
+                          if key in documents}
+    state['snapshots'] = {key: value for (key, value) in state['snapshots'].items()
+                          if key in snapshots}
+    state['entries'] = entries
+    state['log'] = log
+    if state_filename:
+        save_replay_state(state_filename, state)
+    return log
+
+
+def print_replay_log(log):
+    """Print replay change log"""
+    for record in log:
+        if record[1] == 'archive':
+            print('{} archive {} sha256={} p7s={}'.format(format_timestamp(record[0]),
+                                                          *record[2:]))
+        else:
+            print('{} {} {}'.format(format_timestamp(record[0]), record[1], record[2]))
+
+
+def timed(function, timings):
+    """Wrap function to record its call durations in timings"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        """Record call duration"""
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.setdefault(function.__name__, []).append(time.perf_counter() - start)
+    return wrapper
+
+
+def write_allocation_report(filename, snapshot, peak, timings, top):
+    """Write top allocation sites and hot function timings"""
+    with open(filename, 'wt') as report_fd:
+        print('Peak traced memory: {} bytes'.format(peak), file=report_fd)
+        print('Top {} allocation sites:'.format(top), file=report_fd)
+        for stat in snapshot.statistics('lineno')[:top]:
+            print('  {}'.format(stat), file=report_fd)
+        print('Hot functions:', file=report_fd)
+        for name in PROFILED_FUNCTIONS:
+            durations = timings.get(name, [])
+            print('  {}: calls={} total={:.6f}s max={:.6f}s'.format(
+                name, len(durations), sum(durations), max(durations, default=0)),
+                  file=report_fd)
+
+
+def run_profiled(function, prefix, top):
+    """Run function under cProfile and tracemalloc, timing the hot functions"""
+    module = sys.modules[__name__]
+    timings = {}
+    originals = {name: getattr(module, name) for name in PROFILED_FUNCTIONS}
+    for (name, original) in originals.items():
+        setattr(module, name, timed(original, timings))
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        profiler.runcall(function)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        for (name, original) in originals.items():
+            setattr(module, name, original)
+        profiler.dump_stats(prefix + '.pstats')
+        write_allocation_report(prefix + '.alloc', snapshot, peak, timings, top)
+        emit_info('Profile written to {0}.pstats and {0}.alloc'.format(prefix))
+
+
 def main():
     """ Main function"""
     parser = argparse.ArgumentParser(description='DNSSEC Trust Anchor Tool')
-    formats = ['ds', 'dnskey', 'bind-trusted', 'bind-managed']
+    formats = FORMATS
     parser.add_argument("--verbose",
                         dest='verbose',
                         action='store_true',
@@ -202,6 +1540,33 @@ def main():
                         metavar='filename',
                         default=DEFAULT_ANCHORS,
                         help='trust anchor file (root-anchors.xml)')
+    parser.add_argument("--fetch",
+                        dest='fetch',
+                        action='store_true',
+                        help='fetch and verify trust anchor file instead of reading it')
+    parser.add_argument("--fetch-url",
+                        dest='fetch_url',
+                        metavar='url',
+                        default=DEFAULT_ANCHORS_URL,
+                        help='trust anchor file URL')
+    parser.add_argument("--signature-url",
+                        dest='signature_url',
+                        metavar='url',
+                        help='detached signature URL (trust anchor file URL with .p7s)')
+    parser.add_argument("--ca-file",
+                        dest='ca_file',
+                        metavar='filename',
+                        help='CA certificate for the trust anchor signature (ICANN Root CA)')
+    parser.add_argument("--tls-ca-file",
+                        dest='tls_ca_file',
+                        metavar='filename',
+                        help='CA certificates for HTTPS server authentication (system)')
+    parser.add_argument("--fetch-timeout",
+                        dest='fetch_timeout',
+                        metavar='seconds',
+                        type=float,
+                        default=DEFAULT_FETCH_TIMEOUT,
+                        help='timeout for each trust anchor file and signature request')
     parser.add_argument("--format",
                         dest='format',
                         metavar='format',
@@ -212,37 +1577,184 @@ def main():
                         dest='output',
                         metavar='filename',
                         help='output file (stdout)')
+    parser.add_argument("--replay",
+                        dest='replay',
+                        metavar='directory',
+                        help='replay archive of trust anchor files')
+    parser.add_argument("--replay-state",
+                        dest='replay_state',
+                        metavar='filename',
+                        help='replay state file for incremental replay')
+    parser.add_argument("--manifest",
+                        dest='manifest',
+                        metavar='filename',
+                        help='write output for all hosts in manifest (JSON)')
+    parser.add_argument("--jobs",
+                        dest='jobs',
+                        metavar='n',
+                        type=int,
+                        default=DEFAULT_FLEET_JOBS,
+                        help='parallel writers for manifest output')
+    parser.add_argument("--provider",
+                        dest='provider',
+                        metavar='provider',
+                        default='resolver',
+                        help='DNSKEY provider ({})'.format('|'.join(DNSKEY_PROVIDERS)))
+    parser.add_argument("--source",
+                        dest='sources',
+                        metavar='url',
+                        action='append',
+                        help='DNSKEY source (udp://, tcp://, https:// or file:), repeatable')
+    parser.add_argument("--quorum",
+                        dest='quorum',
+                        metavar='n',
+                        type=int,
+                        help='number of DNSKEY sources that must agree (majority)')
+    parser.add_argument("--budget",
+                        dest='budget',
+                        metavar='seconds',
+                        type=float,
+                        default=DEFAULT_QUORUM_BUDGET,
+                        help='time budget for DNSKEY source queries')
+    parser.add_argument("--coordinate",
+                        dest='coordinate',
+                        action='store_true',
+                        help='shard the zones in --anchors-dir across --node workers')
+    parser.add_argument("--work",
+                        dest='work',
+                        metavar='node',
+                        help='work on the zones sharded to node')
+    parser.add_argument("--queue",
+                        dest='queue',
+                        metavar='queue',
+                        help='work queue ([sqlite:]filename)')
+    parser.add_argument("--anchors-dir",
+                        dest='anchors_dir',
+                        metavar='directory',
+                        help='trust anchor files (*.xml) of the zones to shard')
+    parser.add_argument("--node",
+                        dest='nodes',
+                        metavar='node',
+                        action='append',
+                        help='worker node to shard zones to, repeatable')
+    parser.add_argument("--worker-timeout",
+                        dest='worker_timeout',
+                        metavar='seconds',
+                        type=float,
+                        default=DEFAULT_WORKER_TIMEOUT,
+                        help='reassign zones of workers silent for this long')
+    parser.add_argument("--profile",
+                        dest='profile',
+                        metavar='prefix',
+                        help='write profile to prefix.pstats and prefix.alloc')
+    parser.add_argument("--profile-top",
+                        dest='profile_top',
+                        metavar='n',
+                        type=int,
+                        default=DEFAULT_PROFILE_TOP,
+                        help='allocation sites in profile report')
     args = parser.parse_args()
 
-    with open(args.anchors, 'rt') as anchors_fd:
-        doc = xmltodict.parse(anchors_fd.read())
+    if args.quorum is not None and not 1 <= args.quorum <= len(args.sources or []):
+        parser.error('--quorum must be between 1 and the number of --source options')
+    if args.fetch_timeout <= 0:
+        parser.error('--fetch-timeout must be positive')
 
-    zone = doc['TrustAnchor']['Zone']
-    digests = doc['TrustAnchor']['KeyDigest']
+    try:
+        if args.profile:
+            run_profiled(functools.partial(run, args), args.profile, args.profile_top)
+        else:
+            run(args)
+    finally:
+        close_dnskey_providers()
 
-    if isinstance(digests, list):
-        ds_rrset = get_trust_anchors_as_ds(zone, digests, verbose=args.verbose)
+
+def dnskey_fetcher(args):
+    """Get DNSKEY fetch function for parsed arguments"""
+    if args.sources:
+        return functools.partial(fetch_dnskey_quorum,
+                                 sources=args.sources,
+                                 quorum=args.quorum or len(args.sources) // 2 + 1,
+                                 budget=args.budget,
+                                 verbose=args.verbose)
+    return dnskey_provider(args.provider)
+
+
+def run_sharded(args):
+    """Run sharded refresh as coordinator or worker, with parsed arguments"""
+    if not args.queue:
+        raise Exception('Sharded refresh needs --queue')
+    work_queue = open_work_queue(args.queue)
+    if args.work:
+        run_worker(work_queue, args.work, dnskey_fetcher(args), verbose=args.verbose)
+        return
+    if not args.anchors_dir or not args.nodes:
+        raise Exception('Coordinator needs --anchors-dir and --node')
+    results = coordinate(work_queue, load_anchors_dir(args.anchors_dir), args.nodes,
+                         args.format, args.worker_timeout, verbose=args.verbose)
+    (merged, failures) = merge_results(results, args.format, verbose=args.verbose)
+    if failures:
+        raise Exception('{} of {} zones failed'.format(failures, len(results)))
+    if args.output:
+        with open(args.output, 'wt') as output_fd:
+            output_fd.write(merged)
+    else:
+        sys.stdout.write(merged)
+
+
+def run(args):
+    """Run tool with parsed arguments"""
+    if args.coordinate or args.work:
+        run_sharded(args)
+        return
+
+    (log, ds_rrset, dnskey_rrset) = (None, None, None)
+    if args.replay:
+        log = replay_archive(args.replay, args.replay_state, verbose=args.verbose)
     else:
-        ds_rrset = get_trust_anchors_as_ds(zone, [digests], verbose=args.verbose)
+        if args.fetch:
+            if args.ca_file:
+                with open(args.ca_file, 'rb') as ca_fd:
+                    ca_pem = ca_fd.read()
+            else:
+                ca_pem = ICANN_ROOT_CA_CERT.encode()
+            anchors_xml = fetch_verified_anchors(args.fetch_url,
+                                                 args.signature_url or
+                                                 signature_url_for(args.fetch_url),
+                                                 ca_pem, args.fetch_timeout,
+                                                 tls_cafile=args.tls_ca_file,
+                                                 verbose=args.verbose)
+            (zone, digests) = parse_anchors(anchors_xml)
+        else:
+            with open(args.anchors, 'rt') as anchors_fd:
+                (zone, digests) = parse_anchors(anchors_fd.read())
+
+        ds_rrset = get_trust_anchors_as_ds(zone, digests, verbose=args.verbose)
+
+        if args.manifest:
+            hosts = load_fleet_manifest(args.manifest)
+            output_formats = {entry['format'] for entry in hosts.values()}
+        else:
+            output_formats = {args.format}
 
-    if args.format != 'ds':
-        dnskey_rrset = dnskey_from_ds_rrset(ds_rrset, verbose=args.verbose)
+        dnskey_rrset = None
+        if output_formats - {'ds', 'unbound'}:
+            dnskey_rrset = dnskey_from_ds_rrset(ds_rrset, verbose=args.verbose,
+                                                fetch_dnskey=dnskey_fetcher(args))
+
+        if args.manifest:
+            render_fleet(hosts, ds_rrset, dnskey_rrset, args.jobs, verbose=args.verbose)
+            return
 
     if args.output:
         output_fd = open(args.output, 'wt')
         old_stdout = sys.stdout
         sys.stdout = output_fd
 
-    if args.format == 'ds':
-        print_ds_rrset_without_ttl(ds_rrset)
-    elif args.format == 'dnskey':
-        print_dnskey_rrset_without_ttl(dnskey_rrset)
-    elif args.format == 'bind-trusted':
-        bind_trusted_keys(dnskey_rrset)
-    elif args.format == 'bind-managed':
-        bind_managed_keys(dnskey_rrset)
+    if args.replay:
+        print_replay_log(log)
     else:
-        raise Exception('Invalid output format')
+        print_anchors(args.format, ds_rrset, dnskey_rrset)
 
     if args.output:
         sys.stdout = old_stdout
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016, Kirei AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Stub DNS server for regression tests and benchmarks
+
+Answers queries over UDP and TCP from a local zone file. UDP responses that
+do not fit the EDNS buffer size of the query are truncated, and TCP
+connections may carry any number of (pipelined) queries. Stall ports accept
+queries but never answer them.
+
+If a command is given, it is run while the server is up and its exit status
+is returned.
+"""
+
+import sys
+import argparse
+import socket
+import socketserver
+import struct
+import subprocess
+import threading
+import time
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.zone
+
+
+class Counters:
+    """Query and connection counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.udp_queries = 0
+        self.tcp_queries = 0
+        self.tcp_connections = 0
+        self.truncated = 0
+
+    def add(self, name, count=1):
+        """Increment counter"""
+        with self.lock:
+            setattr(self, name, getattr(self, name) + count)
+
+
+def make_response(zone, wire, max_size):
+    """Answer query in wire format from zone, truncating above max_size"""
+    query = dns.message.from_wire(wire)
+    response = dns.message.make_response(query)
+    response.flags |= dns.flags.AA
+    question = query.question[0]
+    rdataset = zone.get_rdataset(question.name, question.rdtype)
+    if rdataset is None:
+        if zone.get_node(question.name) is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+    else:
+        rrset = response.find_rrset(response.answer, question.name,
+                                    question.rdclass, question.rdtype, create=True)
+        rrset.update(rdataset)
+    try:
+        return (response.to_wire(max_size=max_size), False)
+    except dns.exception.TooBig:
+        response.answer = []
+        response.flags |= dns.flags.TC
+        return (response.to_wire(), True)
+
+
+class UDPHandler(socketserver.BaseRequestHandler):
+    """Answer one UDP query"""
+
+    def handle(self):
+        (wire, sock) = self.request
+        query = dns.message.from_wire(wire)
+        max_size = query.payload if query.edns >= 0 else 512
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        (response, truncated) = make_response(self.server.zone, wire, max(max_size, 512))
+        self.server.counters.add('udp_queries')
+        if truncated:
+            self.server.counters.add('truncated')
+        sock.sendto(response, self.client_address)
+
+
+class TCPHandler(socketserver.BaseRequestHandler):
+    """Answer queries on one TCP connection until it is closed"""
+
+    def setup(self):
+        # Send each answer at once, so pipelined answers are not held back
+        # waiting for the ACK of the previous one (Nagle and delayed ACK)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        self.server.counters.add('tcp_connections')
+        rfile = self.request.makefile('rb')
+        while True:
+            try:
+                length_bytes = rfile.read(2)
+            except ConnectionError:
+                break
+            if len(length_bytes) < 2:
+                break
+            wire = rfile.read(struct.unpack('!H', length_bytes)[0])
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            (response, _) = make_response(self.server.zone, wire, 65535)
+            self.server.counters.add('tcp_queries')
+            self.request.sendall(struct.pack('!H', len(response)) + response)
+
+
+class StallHandler(socketserver.BaseRequestHandler):
+    """Accept queries, never answer"""
+
+    def handle(self):
+        if isinstance(self.request, tuple):
+            return
+        while self.request.recv(4096):
+            pass
+
+
+class ThreadingUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    """Threaded UDP server"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded TCP server"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_servers(zone, ports, stall_ports, delay=0, counters=None, address='127.0.0.1'):
+    """Start UDP and TCP servers on ports, return (servers, counters)"""
+    counters = counters or Counters()
+    servers = []
+    for (port, udp_handler, tcp_handler) in \
+            [(port, UDPHandler, TCPHandler) for port in ports] + \
+            [(port, StallHandler, StallHandler) for port in stall_ports]:
+        for (server_class, handler) in [(ThreadingUDPServer, udp_handler),
+                                        (ThreadingTCPServer, tcp_handler)]:
+            server = server_class((address, port), handler)
+            server.zone = zone
+            server.delay = delay
+            server.counters = counters
+            thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+            thread.start()
+            servers.append(server)
+    return (servers, counters)
+
+
+def stop_servers(servers):
+    """Stop servers"""
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    """ Main function"""
+    parser = argparse.ArgumentParser(description='Stub DNS server')
+    parser.add_argument("--zone",
+                        dest='zone',
+                        metavar='filename',
+                        required=True,
+                        help='zone file to serve')
+    parser.add_argument("--origin",
+                        dest='origin',
+                        metavar='name',
+                        default='.',
+                        help='zone origin')
+    parser.add_argument("--port",
+                        dest='ports',
+                        metavar='port',
+                        type=int,
+                        action='append',
+                        default=[],
+                        help='UDP and TCP port to answer on')
+    parser.add_argument("--stall-port",
+                        dest='stall_ports',
+                        metavar='port',
+                        type=int,
+                        action='append',
+                        default=[],
+                        help='UDP and TCP port to accept but never answer on')
+    parser.add_argument("--delay",
+                        dest='delay',
+                        metavar='seconds',
+                        type=float,
+                        default=0,
+                        help='delay before each answer')
+    parser.add_argument("command",
+                        nargs=argparse.REMAINDER,
+                        help='command to run while serving')
+    args = parser.parse_args()
+
+    zone = dns.zone.from_file(args.zone, origin=args.origin, relativize=False)
+    (servers, counters) = start_servers(zone, args.ports, args.stall_ports, args.delay)
+
+    if not args.command:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            stop_servers(servers)
+            return 0
+
+    command = args.command[1:] if args.command[0] == '--' else args.command
+    status = subprocess.call(command)
+    stop_servers(servers)
+    print('stub: {} UDP queries ({} truncated), {} TCP queries on {} connections'.format(
+        counters.udp_queries, counters.truncated,
+        counters.tcp_queries, counters.tcp_connections), file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
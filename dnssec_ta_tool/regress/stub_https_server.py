@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016, Kirei AB
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Stub HTTPS server for regression tests
+
+Serves a trust anchor file and a detached S/MIME signature over it, both
+made with a throwaway test PKI written to a directory: ca.pem signs the
+trust anchor file and the TLS server certificate for 127.0.0.1.
+
+If a command is given, it is run while the server is up and its exit status
+is returned.
+
+Paths under /stall/ serve the same files after a STALL_SECONDS delay, to
+test client timeouts.
+"""
+
+import os
+import sys
+import ssl
+import argparse
+import subprocess
+import threading
+import time
+import http.server
+
+
+def openssl(*args):
+    """Run openssl command"""
+    subprocess.run(['openssl'] + list(args), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_pki(pki_dir, anchors_filename):
+    """Make test CA, signer and TLS certificates, sign trust anchor file"""
+    os.makedirs(pki_dir, exist_ok=True)
+
+    def path(name):
+        """Path of file in PKI directory"""
+        return os.path.join(pki_dir, name)
+
+    openssl('req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-subj', '/CN=Stub CA', '-keyout', path('ca.key'), '-out', path('ca.pem'))
+    for (name, subject, extensions) in [
+            ('signer', '/CN=Stub Trust Anchor Signer', 'keyUsage=digitalSignature'),
+            ('server', '/CN=127.0.0.1', 'subjectAltName=IP:127.0.0.1')]:
+        openssl('req', '-newkey', 'rsa:2048', '-nodes', '-subj', subject,
+                '-keyout', path(name + '.key'), '-out', path(name + '.csr'))
+        with open(path(name + '.ext'), 'wt') as ext_fd:
+            ext_fd.write(extensions + '\n')
+        openssl('x509', '-req', '-days', '1', '-in', path(name + '.csr'),
+                '-CA', path('ca.pem'), '-CAkey', path('ca.key'), '-set_serial', '1',
+                '-extfile', path(name + '.ext'), '-out', path(name + '.pem'))
+    openssl('smime', '-sign', '-binary', '-outform', 'der', '-in', anchors_filename,
+            '-signer', path('signer.pem'), '-inkey', path('signer.key'),
+            '-out', path('root-anchors.p7s'))
+    with open(anchors_filename, 'rb') as anchors_fd:
+        anchors = anchors_fd.read()
+    with open(path('root-anchors.p7s'), 'rb') as signature_fd:
+        signature = signature_fd.read()
+    return {'/root-anchors.xml': anchors, '/root-anchors.p7s': signature}
+
+
+STALL_PREFIX = '/stall'
+STALL_SECONDS = 2
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serve files from memory over kept-alive connections"""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.counters['connections'] += 1
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve one file"""
+        self.server.counters['requests'] += 1
+        path = self.path.split('?')[0]
+        if path.startswith(STALL_PREFIX + '/'):
+            time.sleep(STALL_SECONDS)
+            path = path[len(STALL_PREFIX):]
+        body = self.server.files.get(path)
+        self.send_response(200 if body is not None else 404)
+        body = body if body is not None else b''
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def main():
+    """ Main function"""
+    parser = argparse.ArgumentParser(description='Stub HTTPS server')
+    parser.add_argument("--pki",
+                        dest='pki',
+                        metavar='directory',
+                        required=True,
+                        help='directory for the test PKI')
+    parser.add_argument("--sign",
+                        dest='sign',
+                        metavar='filename',
+                        required=True,
+                        help='trust anchor file to sign and serve')
+    parser.add_argument("--port",
+                        dest='port',
+                        metavar='port',
+                        type=int,
+                        required=True,
+                        help='port to serve HTTPS on')
+    parser.add_argument("command",
+                        nargs=argparse.REMAINDER,
+                        help='command to run while serving')
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+    server.daemon_threads = True
+    server.files = make_pki(args.pki, args.sign)
+    server.counters = {'connections': 0, 'requests': 0}
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(os.path.join(args.pki, 'server.pem'),
+                            os.path.join(args.pki, 'server.key'))
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+
+    if not args.command:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        server.shutdown()
+        return 0
+
+    command = args.command[1:] if args.command[0] == '--' else args.command
+    status = subprocess.call(command)
+    server.shutdown()
+    server.server_close()
+    print('stub: {requests} HTTPS requests on {connections} connections'.format(
+        **server.counters), file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
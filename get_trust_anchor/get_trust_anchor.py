@@ -36,9 +36,27 @@ The steps it uses are:
     Step 3. Validate the signature on the trust anchor file using a built-in IANA CA key
     Step 4. Extract the trust anchor key digests from the trust anchor file
     Step 5. Check the validity period for each digest
-    Step 6. Verify that the trust anchors match the KSK in the root zone file
+    Step 6. Verify that the trust anchors match the KSK in the root zone file, and, when the
+        KSKs come from the root zone file, that a matched KSK signed the DNSKEY RRset
     Step 7. Write out the trust anchors as a DNSKEY and DS records
 
+With --zonefile, step 6 reads a local copy of the root zone instead, for air-gapped use.
+The RRSIG check is done in Python; --rrsig-cache keeps the results between runs, so
+running again against the same zone skips the RSA and ECDSA work.
+
+With --inventory, step 6 also collects the DS records of all delegations from the same pass
+over the root zone file and checks them against the child DNSKEY snapshots given with
+--children, on a pool of worker processes. Step 7 then also writes out the DS inventory.
+
+With --deadline, the steps that use the network (or openssl) share an overall time budget.
+Each gets what is left of it minus the shares held back for the steps after it, so a slow
+mirror cannot stall the run. Google Public DNS is skipped if what is left would not also
+allow for falling back to the root zone file. The time each step used is reported.
+
+With --serve, step 7 instead renders the DNSKEY and DS records, the validated XML and BIND
+trusted-keys/managed-keys statements once and serves them over HTTP, with strong ETags,
+conditional GET and gzip. --benchmark measures that server with a local client.
+
 Note that the validation is done against a built-in ICANN CA, not one retrieved through a
 URL. This means that even if HTTPS authentication checking isn't done, the resulting
 trust anchors are still cryptographically validated.
@@ -50,17 +68,29 @@ from __future__ import print_function
 
 import argparse
 import base64
+import binascii
+import calendar
 import codecs
+import collections
+import contextlib
+import cProfile
 import datetime
+import functools
+import gzip
 import hashlib
+import io
 import json
+import multiprocessing
 import os
 import pprint
 import re
+import socket
 import struct
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import xml.etree.ElementTree
 
 ICANN_ROOT_CA_CERT = '''
@@ -92,6 +122,30 @@ URL_ROOT_ANCHORS_SIGNATURE = "https://data.iana.org/root-anchors/root-anchors.p7
 URL_ROOT_ZONE = "https://www.internic.net/domain/root.zone"
 URL_RESOLVER_API = "https://dns.google.com/resolve?name=.&type=dnskey"
 
+DEFAULT_BENCHMARK_CLIENTS = 8
+DEFAULT_PROFILE_TOP = 20
+
+RRSIG_CACHE_VERSION = 1
+
+# With --deadline, the steps that can stall, in order, with the share of the budget held
+# back for each; time a step does not use is left to the steps after it
+BUDGET_STEPS = [
+    ("anchors", 0.2, "Step 1, fetch the trust anchor file"),
+    ("signature", 0.1, "Step 2, fetch the signature"),
+    ("validate", 0.1, "Step 3, validate the signature"),
+    ("google", 0.2, "Step 6, fetch the KSKs via Google Public DNS"),
+    ("zonefile", 0.4, "Step 6, fetch the KSKs via the root zone file"),
+]
+MIN_STEP_TIMEOUT = 0.5
+
+DEFAULT_INVENTORY_WORKERS = 4
+INVENTORY_BATCH_SIZE = 256
+
+# DS digest types that dnskey_to_hex_of_hash knows
+DS_DIGEST_TYPES = ("1", "2", "4")
+
+PROFILED_FUNCTIONS = ["extract_trust_anchors_from_xml", "get_matching_ksk"]
+
 
 def die(*Strings):
     """Generic way to leave the program early"""
@@ -103,13 +157,25 @@ PYTHON_MINOR = int(sys.version_info[1])
 if (PYTHON_MAJOR == 2) and (PYTHON_MINOR != 7):
     die("If this program is running in Python 2, it must be Python 2.7.")
 
-# Get the urlopen and StringIO functions
+# Get the StringIO function, URL functions, and the HTTP server and client classes
 if PYTHON_MAJOR == 2:
-    from urllib2 import urlopen
     from StringIO import StringIO
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from httplib import HTTPConnection, HTTPSConnection
+    from urlparse import urlsplit, urljoin
 else:
-    from urllib.request import urlopen
     from io import StringIO
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from http.client import HTTPConnection, HTTPSConnection
+    from urllib.parse import urlsplit, urljoin
+
+# Allocation tracing is only in Python 3
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 
 def bytes_to_string(byte_array):
@@ -121,6 +187,134 @@ def bytes_to_string(byte_array):
     return ascii_codec.decode(byte_array)[0]
 
 
+# Connections kept alive between requests, by (scheme, host)
+HTTP_CONNECTIONS = {}
+HTTP_MAX_REDIRECTS = 5
+HTTP_READ_SIZE = 65536
+
+
+def http_get(url, redirects=HTTP_MAX_REDIRECTS, timeout=None):
+    """Takes a URL and an optional timeout in seconds for the whole request; returns the body
+        as bytes, or raises an exception (socket.timeout if the time runs out).
+        The connection is kept alive and reused for later requests to the same host."""
+    end_time = None if timeout is None else time.time() + timeout
+    url_parts = urlsplit(url)
+    key = (url_parts.scheme, url_parts.netloc)
+    path = url_parts.path or "/"
+    if url_parts.query:
+        path += "?" + url_parts.query
+    while True:
+        connection = HTTP_CONNECTIONS.pop(key, None)
+        reused = connection is not None
+        if connection is None:
+            if url_parts.scheme == "https":
+                connection = HTTPSConnection(url_parts.netloc, timeout=timeout)
+            else:
+                connection = HTTPConnection(url_parts.netloc, timeout=timeout)
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            body = read_http_body(connection, response, end_time)
+            break
+        except socket.timeout:
+            connection.close()
+            raise
+        except Exception:
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the kept-alive connection, so try again on a new one
+    if response.will_close:
+        connection.close()
+    else:
+        HTTP_CONNECTIONS[key] = connection
+    location = response.getheader("Location")
+    if response.status in (301, 302, 303, 307, 308) and location and redirects > 0:
+        if end_time is not None:
+            timeout = max(end_time - time.time(), 0)
+        return http_get(urljoin(url, location), redirects - 1, timeout)
+    if response.status != 200:
+        raise IOError("HTTP status {} {}".format(response.status, response.reason))
+    return body
+
+
+def read_http_body(connection, response, end_time):
+    """Takes an HTTP connection, its response, and the time by which it must be read (or None);
+        returns the body as bytes, or raises socket.timeout if it is not read in time"""
+    chunks = []
+    while True:
+        if end_time is not None:
+            time_left = end_time - time.time()
+            if time_left <= 0:
+                raise socket.timeout("timed out reading the response")
+            if connection.sock is not None:
+                connection.sock.settimeout(time_left)
+        chunk = response.read(HTTP_READ_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+class Budget(object):
+    """The overall time budget of a run (--deadline), split into per-step timeouts.
+        Each step gets what is left of the budget minus the shares held back for the steps
+        after it, and the time each step used is kept for the report."""
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.start_time = time.time()
+        self.used = []
+
+    def remaining(self):
+        """Returns the seconds left in the budget, or None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - (time.time() - self.start_time), 0)
+
+    def timeout(self, step):
+        """Takes a step name; returns its share of the budget in seconds, which may be 0, or None
+            if there is no deadline"""
+        if self.deadline is None:
+            return None
+        names = [name for (name, _, _) in BUDGET_STEPS]
+        held_back = sum(share for (_, share, _) in BUDGET_STEPS[names.index(step) + 1:])
+        return max(self.remaining() - self.deadline * held_back, 0)
+
+    @contextlib.contextmanager
+    def step(self, step):
+        """Takes a step name; yields the timeout for the step, and records the time used.
+            A step gets at least MIN_STEP_TIMEOUT, taken from the shares of the steps after it,
+            as a timeout of 0 would make sockets non-blocking and stop openssl at once; if less
+            than that is left of the budget, it dies."""
+        timeout = self.timeout(step)
+        if timeout is not None and timeout < MIN_STEP_TIMEOUT:
+            remaining = self.remaining()
+            if remaining < MIN_STEP_TIMEOUT:
+                descriptions = dict((name, description) for (name, _, description)\
+                    in BUDGET_STEPS)
+                die("The {:.2f}s time budget was exhausted before {} ({:.2f}s left).".format(\
+                    self.deadline, descriptions[step], remaining))
+            timeout = MIN_STEP_TIMEOUT
+        start_time = time.time()
+        try:
+            yield timeout
+        finally:
+            self.used.append((step, time.time() - start_time, timeout))
+
+    def report(self):
+        """Returns nothing, but prints the time each step used out of its timeout"""
+        if self.deadline is None:
+            return
+        descriptions = dict((name, description) for (name, _, description) in BUDGET_STEPS)
+        print("Used {:.2f}s of the {:.2f}s time budget:".format(time.time() - self.start_time,\
+            self.deadline))
+        for (step, used, timeout) in self.used:
+            print("  {}: {:.2f}s of {:.2f}s".format(descriptions[step], used, timeout))
+
+
 def write_out_file(file_name, file_contents):
     """Takes a name of a file and string or bytearray; returns nothing.
         Writes out a file that we got from a URL or string; backs up the file if it exists."""
@@ -146,16 +340,19 @@ def write_out_file(file_name, file_contents):
     return
 
 
-def dnskey_to_hex_of_hash(dnskey_dict, hash_type):
-    """Takes a DNSKEY dict and hash type (string), and returns the hex of the hash as a string"""
+def dnskey_to_hex_of_hash(dnskey_dict, hash_type, owner="."):
+    """Takes a DNSKEY dict, hash type (string) and optionally the owner name of the DNSKEY
+        (the root by default), and returns the hex of the hash as a string"""
     if hash_type == "1":
         this_hash = hashlib.sha1()
     elif hash_type == "2":
         this_hash = hashlib.sha256()
+    elif hash_type == "4":
+        this_hash = hashlib.sha384()
     else:
         die("A DNSKEY dict had a hash type of {}, which is unknown.".format(hash_type))
     digest_content = bytearray()
-    digest_content.append(0)  # Name of the zone, expressed in wire format
+    digest_content.extend(name_to_wire(owner))  # Name of the zone, expressed in wire format
     digest_content.extend(struct.pack("!HBB", int(dnskey_dict["f"]),\
         int(dnskey_dict["p"]), int(dnskey_dict["a"])))
     key_bytes = base64.b64decode(dnskey_dict["k"])
@@ -164,31 +361,57 @@ def dnskey_to_hex_of_hash(dnskey_dict, hash_type):
     return (this_hash.hexdigest()).upper()
 
 
-def fetch_ksk():
-    """Return the KSKs, or die if they can't be found in via Google nor the zone file"""
-    print("Fetching via Google Public DNS...")
-    ksks = fetch_ksk_from_google()
-    if ksks is None:
-        print("Fetching via Google Public DNS failed. Fetching via the root zone file...")
-        ksks = fetch_ksk_from_zonefile()
+def fetch_ksk(zone_filename=None, ds_index=None, budget=None, resolver_url=URL_RESOLVER_API,\
+        zone_url=URL_ROOT_ZONE):
+    """Takes an optional name of a local root zone file, an optional DS index to fill in, the
+        time budget and the URLs to use; returns the KSKs and the zone apex (the DNSKEYs and the
+        RRSIGs over them, or None if the KSKs came from Google), or dies if they can't be found
+        in via Google nor the zone file. The zone file is always used if there is a DS index to
+        fill in. Google is skipped if the time budget left would not also allow for falling
+        back to the zone file."""
+    budget = budget or Budget()
+    apex = None
+    if zone_filename or ds_index is not None:
+        print("Reading the root zone file {}...".format(zone_filename or zone_url))
+        with budget.step("zonefile") as timeout:
+            apex = fetch_ksk_from_zonefile(zone_filename, ds_index, zone_url, timeout)
+        if apex is None:
+            die("Could not read the root zone file {}.".format(zone_filename or zone_url))
+    else:
+        google_timeout = budget.timeout("google")
+        if google_timeout is not None and google_timeout < MIN_STEP_TIMEOUT:
+            print("Only {:.2f}s of the time budget is left for Google Public DNS, so fetching"\
+                " via the root zone file...".format(google_timeout))
+            ksks = None
+        else:
+            print("Fetching via Google Public DNS...")
+            with budget.step("google") as timeout:
+                ksks = fetch_ksk_from_google(resolver_url, timeout)
+            if ksks is None:
+                print("Fetching via Google Public DNS failed. Fetching via the root zone file...")
         if ksks is None:
-            die("Could not fetch the KSKs from Google Public DNS nor get the root zone file.")
+            with budget.step("zonefile") as timeout:
+                apex = fetch_ksk_from_zonefile(None, None, zone_url, timeout)
+            if apex is None:
+                die("Could not fetch the KSKs from Google Public DNS nor get the root zone file.")
+    if apex is not None:
+        ksks = [this_key for this_key in apex["dnskeys"] if this_key["f"] == "257"]
     if len(ksks) == 0:
         die("No KSKs were found.")
-    return ksks
+    return (ksks, apex)
 
 
-def fetch_ksk_from_google():
+def fetch_ksk_from_google(url=URL_RESOLVER_API, timeout=None):
     """Return the root KSK via Google DNS-over-HTTPS. Returns None if there are errors."""
     ksks = []
     try:
-        url = urlopen(URL_RESOLVER_API)
+        resolver_api_contents = http_get(url, timeout=timeout)
     except Exception as this_exception:
         print("Was not able to open URL {}. The returned text was '{}'.".format(\
-            URL_RESOLVER_API, this_exception))
+            url, this_exception))
         return None
     try:
-        data = json.loads(url.read().decode('utf-8'))
+        data = json.loads(resolver_api_contents.decode('utf-8'))
     except Exception as this_exception:
         print("The JSON returned from Google DNS-over-HTTPS was not readable: {}".format(\
             this_exception))
@@ -201,32 +424,80 @@ def fetch_ksk_from_google():
     return ksks
 
 
-def fetch_ksk_from_zonefile():
-    """Rethurn the root KSK from the root zone file. Returns None if there are errors."""
-    ksks = []
+def fetch_ksk_from_zonefile(zone_filename=None, ds_index=None, url=URL_ROOT_ZONE, timeout=None):
+    """Takes an optional name of a local root zone file, or gets the root zone file from its URL
+        within the timeout, and an optional DS index to fill in; returns the zone apex as a
+        dict with the DNSKEYs and the RRSIGs over them. Returns None if there are errors."""
+    if zone_filename:
+        try:
+            with open(zone_filename, mode="rt") as zone_file:
+                return read_zone_apex(zone_file, ds_index)
+        except Exception as this_exception:
+            print("Was not able to read {}. The returned text was '{}'.".format(\
+                zone_filename, this_exception))
+            return None
     try:
-        url = urlopen(URL_ROOT_ZONE)
+        root_zone_contents = http_get(url, timeout=timeout)
     except Exception as this_exception:
         print("Was not able to open URL {}. The returned text was '{}'.".format(\
-            URL_ROOT_ZONE, this_exception))
+            url, this_exception))
         return None
-    for line in url.read().decode('utf-8').split('\n'):
-        if "DNSKEY\t" in line:
-            (_, _, _, _, flags, proto, alg, key_b64) = re.split(r"\s+", line)
-            if flags == '257':
-                ksks.append({'f': flags, 'p': proto, 'a': alg, 'k': key_b64})
-    return ksks
+    return read_zone_apex(root_zone_contents.decode('utf-8').split('\n'), ds_index)
+
+
+def read_zone_apex(zone_lines, ds_index=None):
+    """Takes the lines of the root zone file and an optional DS index; returns a dict with the
+        apex DNSKEYs (of all flags) and the RRSIGs that cover the DNSKEY RRset.
+        If there is a DS index, the DS records of the delegations are added to it in the
+        same pass, keyed by (owner, key tag)."""
+    apex = {"dnskeys": [], "rrsigs": []}
+    for line in zone_lines:
+        if "DNSKEY" not in line and (ds_index is None or "DS" not in line):
+            continue
+        fields = re.split(r"\s+", line.strip())
+        if len(fields) < 8:
+            continue
+        if fields[3] == "DS" and ds_index is not None:
+            ds_index.setdefault((fields[0].lower(), int(fields[4])), []).append(\
+                {'a': fields[5], 'h': fields[6], 'd': "".join(fields[7:]).upper()})
+            continue
+        if fields[0] != ".":
+            continue
+        if fields[3] == "DNSKEY":
+            apex["dnskeys"].append({'f': fields[4], 'p': fields[5], 'a': fields[6],\
+                'k': "".join(fields[7:])})
+        elif fields[3] == "RRSIG" and fields[4] == "DNSKEY" and len(fields) >= 13:
+            apex["rrsigs"].append({'a': fields[5], 'labels': fields[6], 'ttl': fields[7],\
+                'expiration': fields[8], 'inception': fields[9], 'tag': fields[10],\
+                'signer': fields[11], 'signature': "".join(fields[12:])})
+    return apex
 
 
-def validate_detached_signature(contents_filename, signature_filename, ca_filename):
-    """Takes the name of the contents file, the signature file, and CA file;
-        returns nothing if sucessful or dies if openssl returns an error."""
+def validate_detached_signature(contents_filename, signature_filename, ca_filename,\
+        timeout=None):
+    """Takes the name of the contents file, the signature file, and CA file, and an optional
+        timeout; returns nothing if sucessful or dies if openssl returns an error or does not
+        finish in time."""
     # Run openssl to validate the signature
-    validate_command = "openssl smime -verify -CAfile {ca} -inform der -in {sig} -content {cont}"
-    validate_popen = subprocess.Popen(validate_command.format(\
-        ca=ca_filename, sig=signature_filename, cont=contents_filename),\
-        shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    validate_command = ["openssl", "smime", "-verify", "-CAfile", ca_filename, "-inform", "der",\
+        "-in", signature_filename, "-content", contents_filename]
+    validate_popen = subprocess.Popen(validate_command,\
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # A timer rather than communicate(timeout=...), which Python 2.7 does not have
+    timed_out = threading.Event()
+    def kill_openssl():
+        """Kill openssl when the timeout runs out"""
+        timed_out.set()
+        validate_popen.kill()
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill_openssl)
+        timer.start()
     (validate_out, validate_err) = validate_popen.communicate()
+    if timer is not None:
+        timer.cancel()
+    if timed_out.is_set():
+        die("openssl did not finish validating the signature within {:.2f}s.".format(timeout))
     if validate_popen.returncode != 0:
         die("When running openssl, the return code was {} ".format(validate_popen.returncode),\
             "and the output was the following.\n{} {}".format(validate_err, validate_out))
@@ -343,45 +614,715 @@ def get_matching_ksk(ksk_records, valid_trust_anchors):
     return matched_ksks
 
 
+# DigestInfo prefixes for RSA PKCS #1 v1.5 signatures, by DNSSEC algorithm number
+RSA_ALGORITHMS = {
+    5: (hashlib.sha1, "3021300906052b0e03021a05000414"),
+    7: (hashlib.sha1, "3021300906052b0e03021a05000414"),
+    8: (hashlib.sha256, "3031300d060960864801650304020105000420"),
+    10: (hashlib.sha512, "3051300d060960864801650304020305000440"),
+}
+
+# ECDSA curves (all with a = -3), by DNSSEC algorithm number: (p, b, n, Gx, Gy, hash)
+ECDSA_ALGORITHMS = {
+    13: (2**256 - 2**224 + 2**192 + 2**96 - 1,
+         0x5ac635d8aa3a93e7b3ebbd55769886bc651d06b0cc53b0f63bce3c3e27d2604b,
+         0xffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551,
+         0x6b17d1f2e12c4247f8bce6e563a440f277037d812deb33a0f4a13945d898c296,
+         0x4fe342e2fe1a7f9b8ee7eb4a7c0f9e162bce33576b315ececbb6406837bf51f5,
+         hashlib.sha256),
+    14: (2**384 - 2**128 - 2**96 + 2**32 - 1,
+         int("b3312fa7e23ee7e4988e056be3f82d19181d9c6efe814112"
+             "0314088f5013875ac656398d8a2ed19d2a85c8edd3ec2aef", 16),
+         int("ffffffffffffffffffffffffffffffffffffffffffffffff"
+             "c7634d81f4372ddf581a0db248b0a77aecec196accc52973", 16),
+         int("aa87ca22be8b05378eb1c71ef320ad746e1d3b628ba79b98"
+             "59f741e082542a385502f25dbf55296c3a545e3872760ab7", 16),
+         int("3617de4a96262c6f5d9e98bf9292dc29f8f41dbd289a147c"
+             "e9da3113b5f0b8c00a60b1ce1d7e819d7a431d7c90ea0e5f", 16),
+         hashlib.sha384),
+}
+
+
+def bytes_to_int(byte_array):
+    """Takes bytes; returns them as a big-endian unsigned integer"""
+    if len(byte_array) == 0:
+        return 0
+    return int(binascii.hexlify(bytes(byte_array)), 16)
+
+
+def int_to_bytes(number, length):
+    """Takes an unsigned integer and a length; returns it as big-endian bytes of that length"""
+    return binascii.unhexlify("{:0{}x}".format(number, length * 2))
+
+
+def name_to_wire(name):
+    """Takes a domain name; returns it in canonical (lowercase) wire format"""
+    wire = bytearray()
+    for label in name.rstrip(".").split("."):
+        if label:
+            wire.append(len(label))
+            wire.extend(label.lower().encode("ascii"))
+    wire.append(0)
+    return bytes(wire)
+
+
+def dnskey_rdata(dnskey):
+    """Takes a DNSKEY dict; returns its rdata in wire format"""
+    return struct.pack("!HBB", int(dnskey["f"]), int(dnskey["p"]), int(dnskey["a"])) +\
+        base64.b64decode(dnskey["k"])
+
+
+def rrsig_time(value):
+    """Takes an RRSIG inception or expiration field; returns it as seconds since the epoch"""
+    if len(value) == 14:
+        return calendar.timegm(time.strptime(value, "%Y%m%d%H%M%S"))
+    return int(value)
+
+
+def rrsig_signed_data(rrsig, dnskeys, owner="."):
+    """Takes an RRSIG dict and the DNSKEYs it covers; returns the data that was signed
+        (RFC 4034 section 3.1.8.1), with the DNSKEY RRs in canonical order"""
+    signed_data = bytearray(struct.pack("!HBBIIIH", 48, int(rrsig["a"]), int(rrsig["labels"]),\
+        int(rrsig["ttl"]), rrsig_time(rrsig["expiration"]), rrsig_time(rrsig["inception"]),\
+        int(rrsig["tag"])))
+    signed_data.extend(name_to_wire(rrsig["signer"]))
+    owner_wire = name_to_wire(owner)
+    for rdata in sorted(set(dnskey_rdata(this_key) for this_key in dnskeys)):
+        signed_data.extend(owner_wire)
+        signed_data.extend(struct.pack("!HHIH", 48, 1, int(rrsig["ttl"]), len(rdata)))
+        signed_data.extend(rdata)
+    return bytes(signed_data)
+
+
+def verify_rsa(algorithm, key, signature, signed_data):
+    """Takes a DNSSEC algorithm number, an RSA DNSKEY public key (RFC 3110), a signature and
+        the signed data; returns True if the PKCS #1 v1.5 signature is valid"""
+    (hash_function, digest_info) = RSA_ALGORITHMS[algorithm]
+    key = bytearray(key)
+    if key[0] == 0:
+        (exponent_start, exponent_length) = (3, (key[1] << 8) | key[2])
+    else:
+        (exponent_start, exponent_length) = (1, key[0])
+    exponent = bytes_to_int(key[exponent_start:exponent_start + exponent_length])
+    modulus = bytes_to_int(key[exponent_start + exponent_length:])
+    modulus_length = (modulus.bit_length() + 7) // 8
+    signature_number = bytes_to_int(bytearray(signature))
+    if modulus == 0 or signature_number >= modulus:
+        return False
+    encoded = int_to_bytes(pow(signature_number, exponent, modulus), modulus_length)
+    suffix = binascii.unhexlify(digest_info) + hash_function(signed_data).digest()
+    expected = b"\x00\x01" + b"\xff" * (modulus_length - len(suffix) - 3) + b"\x00" + suffix
+    return encoded == expected
+
+
+def ec_add(prime, point1, point2):
+    """Takes the curve prime and two affine points (None is the point at infinity) on a curve
+        with a = -3; returns their sum"""
+    if point1 is None:
+        return point2
+    if point2 is None:
+        return point1
+    ((x1, y1), (x2, y2)) = (point1, point2)
+    if x1 == x2:
+        if (y1 + y2) % prime == 0:
+            return None
+        slope = (3 * x1 * x1 - 3) * pow(2 * y1, prime - 2, prime) % prime
+    else:
+        slope = (y2 - y1) * pow(x2 - x1, prime - 2, prime) % prime
+    x3 = (slope * slope - x1 - x2) % prime
+    return (x3, (slope * (x1 - x3) - y1) % prime)
+
+
+def ec_multiply(prime, point, scalar):
+    """Takes the curve prime, an affine point and a scalar; returns the scalar multiple"""
+    result = None
+    while scalar:
+        if scalar & 1:
+            result = ec_add(prime, result, point)
+        point = ec_add(prime, point, point)
+        scalar >>= 1
+    return result
+
+
+def verify_ecdsa(algorithm, key, signature, signed_data):
+    """Takes a DNSSEC algorithm number, an ECDSA DNSKEY public key (RFC 6605), a signature and
+        the signed data; returns True if the signature is valid"""
+    (prime, curve_b, order, base_x, base_y, hash_function) = ECDSA_ALGORITHMS[algorithm]
+    half = len(key) // 2
+    public = (bytes_to_int(bytearray(key[:half])), bytes_to_int(bytearray(key[half:])))
+    if (public[1] ** 2 - public[0] ** 3 + 3 * public[0] - curve_b) % prime != 0:
+        return False
+    half = len(signature) // 2
+    (r_value, s_value) = (bytes_to_int(bytearray(signature[:half])),\
+        bytes_to_int(bytearray(signature[half:])))
+    if not (0 < r_value < order and 0 < s_value < order):
+        return False
+    digest = bytes_to_int(bytearray(hash_function(signed_data).digest()))
+    s_inverse = pow(s_value, order - 2, order)
+    point = ec_add(prime, ec_multiply(prime, (base_x, base_y), digest * s_inverse % order),\
+        ec_multiply(prime, public, r_value * s_inverse % order))
+    return point is not None and point[0] % order == r_value
+
+
+def verify_signature(algorithm, key, signature, signed_data):
+    """Takes a DNSSEC algorithm number, a DNSKEY public key, a signature and the signed data;
+        returns True if the signature is valid, or raises ValueError for unknown algorithms"""
+    if algorithm in RSA_ALGORITHMS:
+        return verify_rsa(algorithm, key, signature, signed_data)
+    if algorithm in ECDSA_ALGORITHMS:
+        return verify_ecdsa(algorithm, key, signature, signed_data)
+    raise ValueError("DNSSEC algorithm {} is not supported".format(algorithm))
+
+
+def load_rrsig_cache(cache_filename):
+    """Takes the name of the RRSIG cache file; returns the cached results as a dict"""
+    try:
+        with open(cache_filename, mode="rt") as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != RRSIG_CACHE_VERSION:
+        return {}
+    return cache.get("results", {})
+
+
+def save_rrsig_cache(cache_filename, results):
+    """Takes the name of the RRSIG cache file and the results; returns nothing.
+        The file is replaced atomically so a reader never sees a partial cache."""
+    temp_filename = "{}.{}.tmp".format(cache_filename, os.getpid())
+    try:
+        with open(temp_filename, mode="wt") as cache_file:
+            json.dump({"version": RRSIG_CACHE_VERSION, "results": results}, cache_file,\
+                indent=1, sort_keys=True)
+        os.rename(temp_filename, cache_filename)
+    except (IOError, OSError) as this_exception:
+        print("Could not write the RRSIG cache {}: '{}'. Continuing".format(cache_filename,\
+            this_exception))
+
+
+def check_dnskey_rrsig(apex, matched_ksks, cache_filename=None, now=None):
+    """Takes the zone apex (DNSKEYs and RRSIGs), the matched KSKs, and an optional name of the
+        RRSIG cache file; returns the RRSIG that validates the DNSKEY RRset, or dies if no
+        matched KSK signed the DNSKEY RRset within the RRSIG validity period.
+        The validity period is always checked, but signature results are cached by the hash
+        of the key, signature and signed data, so an unchanged zone needs no public key work."""
+    if now is None:
+        now = int(time.time())
+    results = load_rrsig_cache(cache_filename) if cache_filename else {}
+    results_changed = False
+    for this_rrsig in apex["rrsigs"]:
+        signers = [this_ksk for this_ksk in matched_ksks if this_ksk["a"] == this_rrsig["a"]\
+            and ksk_key_tag(this_ksk) == int(this_rrsig["tag"])]
+        if this_rrsig["signer"] != "." or len(signers) == 0:
+            print("RRSIG by key tag {} is not from a matched KSK, so not using it.".format(\
+                this_rrsig["tag"]))
+            continue
+        (inception, expiration) = (rrsig_time(this_rrsig["inception"]),\
+            rrsig_time(this_rrsig["expiration"]))
+        if not inception <= now <= expiration:
+            print("RRSIG by key tag {} is valid from {} to {}, which does not include now, so not"\
+                " using it.".format(this_rrsig["tag"], this_rrsig["inception"],\
+                this_rrsig["expiration"]))
+            continue
+        signed_data = rrsig_signed_data(this_rrsig, apex["dnskeys"])
+        signature = base64.b64decode(this_rrsig["signature"])
+        for this_ksk in signers:
+            key = base64.b64decode(this_ksk["k"])
+            cache_key = hashlib.sha256(key + signature + signed_data).hexdigest()
+            if cache_key in results:
+                verified = results[cache_key]
+                source = "cached"
+            else:
+                try:
+                    verified = verify_signature(int(this_rrsig["a"]), key, signature,\
+                        signed_data)
+                except ValueError as this_exception:
+                    print("RRSIG by key tag {}: {}.".format(this_rrsig["tag"], this_exception))
+                    continue
+                results[cache_key] = verified
+                results_changed = True
+                source = "verified"
+            if verified:
+                print("The DNSKEY RRset is signed by the KSK with key tag {}, valid until {}"\
+                    " ({}).".format(this_rrsig["tag"], this_rrsig["expiration"], source))
+                if cache_filename and results_changed:
+                    save_rrsig_cache(cache_filename, results)
+                return this_rrsig
+            print("RRSIG by key tag {} does not validate ({}).".format(this_rrsig["tag"], source))
+    if cache_filename and results_changed:
+        save_rrsig_cache(cache_filename, results)
+    die("No RRSIG over the root DNSKEY RRset validates with a matched KSK.")
+    return None
+
+
+def read_child_dnskeys(children_path, digest_types):
+    """Takes the name of a file, or a directory of files, with child DNSKEY records, and a dict
+        of the DS digest types needed for each owner; yields (owner, DNSKEY dict, digest types)
+        for each DNSKEY of an owner in the dict, reading one line at a time"""
+    if os.path.isdir(children_path):
+        filenames = [os.path.join(children_path, name) for name in\
+            sorted(os.listdir(children_path))]
+    else:
+        filenames = [children_path]
+    for filename in filenames:
+        with open(filename, mode="rt") as child_file:
+            for line in child_file:
+                if "DNSKEY" not in line:
+                    continue
+                fields = re.split(r"\s+", line.strip())
+                if len(fields) < 8 or fields[3] != "DNSKEY":
+                    continue
+                owner = fields[0].lower()
+                if owner in digest_types:
+                    yield (owner, {'f': fields[4], 'p': fields[5], 'a': fields[6],\
+                        'k': "".join(fields[7:])}, digest_types[owner])
+
+
+def hash_child_dnskeys(batch):
+    """Takes a list of (owner, DNSKEY dict, digest types); returns a list of
+        (owner, key tag, algorithm, dict of digest type to hex digest). Runs in the worker pool."""
+    results = []
+    for (owner, dnskey, digest_types) in batch:
+        results.append((owner, ksk_key_tag(dnskey), dnskey["a"],\
+            dict((this_type, dnskey_to_hex_of_hash(dnskey, this_type, owner))\
+            for this_type in digest_types)))
+    return results
+
+
+def map_batches(pool, function, items, batch_size, window):
+    """Takes a process pool (or None), a function, an iterable and the batch size; yields the
+        function of each batch of items in order. At most window batches are in flight at
+        once, so the items are never all in memory."""
+    batch = []
+    pending = collections.deque()
+    for item in items:
+        batch.append(item)
+        if len(batch) < batch_size:
+            continue
+        if pool is None:
+            yield function(batch)
+        else:
+            pending.append(pool.apply_async(function, (batch,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        batch = []
+    if batch:
+        if pool is None:
+            yield function(batch)
+        else:
+            pending.append(pool.apply_async(function, (batch,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def check_delegations(ds_index, children_path, workers):
+    """Takes the DS index, the name of the child DNSKEY snapshots (or None) and the number of
+        worker processes; returns the DS inventory as a sorted list of
+        (owner, key tag, DS dict, status) tuples. The status is "valid" if a child DNSKEY
+        matches the DS, "mismatch" if a child DNSKEY has the key tag but not the digest,
+        "missing" if the child has no DNSKEY with the key tag, "no-snapshot" if there is no
+        snapshot of the child, or "unsupported" for an unknown digest type."""
+    digest_types = {}
+    for ((owner, _), ds_records) in ds_index.items():
+        needed = digest_types.setdefault(owner, set())
+        needed.update(this_ds["h"] for this_ds in ds_records if this_ds["h"] in DS_DIGEST_TYPES)
+    digest_types = dict((owner, sorted(needed)) for (owner, needed) in digest_types.items())
+    valid = set()
+    seen_tags = set()
+    seen_owners = set()
+    if children_path:
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            for results in map_batches(pool, hash_child_dnskeys,\
+                    read_child_dnskeys(children_path, digest_types), INVENTORY_BATCH_SIZE,\
+                    workers * 2):
+                for (owner, key_tag, algorithm, digests) in results:
+                    seen_owners.add(owner)
+                    seen_tags.add((owner, key_tag))
+                    for this_ds in ds_index.get((owner, key_tag), []):
+                        if this_ds["a"] == algorithm and digests.get(this_ds["h"]) == this_ds["d"]:
+                            valid.add((owner, key_tag, this_ds["a"], this_ds["h"], this_ds["d"]))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    inventory = []
+    for ((owner, key_tag), ds_records) in ds_index.items():
+        for this_ds in ds_records:
+            if this_ds["h"] not in DS_DIGEST_TYPES:
+                status = "unsupported"
+            elif (owner, key_tag, this_ds["a"], this_ds["h"], this_ds["d"]) in valid:
+                status = "valid"
+            elif (owner, key_tag) in seen_tags:
+                status = "mismatch"
+            elif owner in seen_owners:
+                status = "missing"
+            else:
+                status = "no-snapshot"
+            inventory.append((owner, key_tag, this_ds, status))
+    inventory.sort(key=lambda entry: (entry[0], entry[1], entry[2]["a"], entry[2]["h"]))
+    return inventory
+
+
+def ds_inventory_as_text(inventory):
+    """Takes the DS inventory; returns it as tab-separated lines"""
+    lines = ["; owner\tkeytag\talgorithm\tdigesttype\tdigest\tstatus\n"]
+    for (owner, key_tag, this_ds, status) in inventory:
+        lines.append("{}\t{}\t{}\t{}\t{}\t{}\n".format(owner, key_tag, this_ds["a"],\
+            this_ds["h"], this_ds["d"], status))
+    return "".join(lines)
+
+
+def report_ds_inventory(inventory):
+    """Takes the DS inventory; returns nothing but prints a summary"""
+    statuses = collections.Counter(status for (_, _, _, status) in inventory)
+    owners = set(owner for (owner, _, _, _) in inventory)
+    secure = set(owner for (owner, _, _, status) in inventory if status == "valid")
+    print("There were {} DS records for {} delegations: {}.".format(len(inventory),\
+        len(owners), ", ".join("{} {}".format(statuses[status], status)\
+        for status in sorted(statuses))))
+    print("{} delegations have a DS record that matches a child DNSKEY.".format(len(secure)))
+    for (owner, key_tag, _, status) in inventory:
+        if status == "mismatch":
+            print("The DS record of {} with key tag {} does not match the child DNSKEY.".format(\
+                owner, key_tag))
+
+
+def ksk_key_tag(ksk):
+    """Takes a KSK dict; returns its key tag"""
+    tag_base = bytearray()
+    tag_base.extend(struct.pack("!HBB", int(ksk["f"]), int(ksk["p"]), int(ksk["a"])))
+    key_bytes = base64.b64decode(ksk["k"])
+    tag_base.extend(key_bytes)
+    accumulator = 0
+    for (counter, this_byte) in enumerate(tag_base):
+        if (counter % 2) == 0:
+            accumulator += (this_byte << 8)
+        else:
+            accumulator += this_byte
+    return ((accumulator & 0xFFFF) + (accumulator>>16)) & 0xFFFF
+
+
+def ksk_as_dnskey_record(ksk):
+    """Takes a KSK dict; returns it as a DNSKEY record line"""
+    return ". IN DNSKEY {flags} {proto} {alg} {keyas64}\n".format(\
+        flags=ksk["f"], proto=ksk["p"], alg=ksk["a"], keyas64=ksk["k"])
+
+
+def ksk_as_ds_record(ksk):
+    """Takes a KSK dict; returns it as a SHA-256 DS record line"""
+    hash_as_hex = dnskey_to_hex_of_hash(ksk, "2")  # Always do SHA256
+    return ". IN DS {keytag} {alg} 2 {sha256ofkey}\n".format(\
+        keytag=ksk_key_tag(ksk), alg=ksk["a"], sha256ofkey=hash_as_hex)
+
+
+def ksks_as_bind_keys(ksks, statement, key_type):
+    """Takes a list of KSKs; returns a BIND trusted-keys or managed-keys statement"""
+    lines = ["{} {{\n".format(statement)]
+    for ksk in ksks:
+        lines.append('  "." {}{} {} {} "{}";\n'.format(key_type, ksk["f"], ksk["p"],\
+            ksk["a"], ksk["k"]))
+    lines.append("};\n")
+    return "".join(lines)
+
+
 def export_ksk(valid_ksks, ds_record_filename, dnskey_record_filename):
     """Takes a list of KSKs; returns nothing but writes out files"""
-    ##############################
-    # Still to do:
-    #   BIND output formats
-    ##############################
     for this_matched_ksk in valid_ksks:
         # Write out the DNSKEY
-        dnskey_record_contents = ". IN DNSKEY {flags} {proto} {alg} {keyas64}\n".format(\
-            flags=this_matched_ksk["f"], proto=this_matched_ksk["p"],\
-            alg=this_matched_ksk["a"], keyas64=this_matched_ksk["k"])
+        dnskey_record_contents = ksk_as_dnskey_record(this_matched_ksk)
         print("Writing out {}.".format(dnskey_record_filename))
         write_out_file(dnskey_record_filename, dnskey_record_contents)
         # Write out the DS
-        hash_as_hex = dnskey_to_hex_of_hash(this_matched_ksk, "2")  # Always do SHA256
-        # Calculate the keytag
-        tag_base = bytearray()
-        tag_base.extend(struct.pack("!HBB", int(this_matched_ksk["f"]), int(this_matched_ksk["p"]),\
-            int(this_matched_ksk["a"])))
-        key_bytes = base64.b64decode(this_matched_ksk["k"])
-        tag_base.extend(key_bytes)
-        accumulator = 0
-        for (counter, this_byte) in enumerate(tag_base):
-            if (counter % 2) == 0:
-                accumulator += (this_byte << 8)
-            else:
-                accumulator += this_byte
-        this_key_tag = ((accumulator & 0xFFFF) + (accumulator>>16)) & 0xFFFF
-        print("The key tag for this KSK is {}".format(this_key_tag))
-        ds_record_contents = ". IN DS {keytag} {alg} 2 {sha256ofkey}\n".format(\
-            keytag=this_key_tag, alg=this_matched_ksk["a"],\
-            sha256ofkey=hash_as_hex)
+        print("The key tag for this KSK is {}".format(ksk_key_tag(this_matched_ksk)))
+        ds_record_contents = ksk_as_ds_record(this_matched_ksk)
         print("Writing out {}.".format(ds_record_filename))
         write_out_file(ds_record_filename, ds_record_contents)
 
 
+def make_response(body, content_type):
+    """Takes a body (bytes) and content type; returns a precomputed response dict
+        with identity and gzip representations, each with its own strong ETag."""
+    gzip_buffer = io.BytesIO()
+    gzip_file = gzip.GzipFile(fileobj=gzip_buffer, mode="wb", mtime=0)
+    gzip_file.write(body)
+    gzip_file.close()
+    etag = hashlib.sha256(body).hexdigest()[0:32]
+    return {
+        "type": content_type,
+        "identity": (body, '"{}"'.format(etag)),
+        "gzip": (gzip_buffer.getvalue(), '"{}-gzip"'.format(etag))
+    }
+
+
+def make_served_responses(trust_anchor_xml, matched_ksks):
+    """Takes the validated XML and matched KSKs; returns a dict of path to response"""
+    if not isinstance(trust_anchor_xml, bytes):
+        trust_anchor_xml = trust_anchor_xml.encode("utf-8")
+    dnskey_records = "".join([ksk_as_dnskey_record(ksk) for ksk in matched_ksks])
+    ds_records = "".join([ksk_as_ds_record(ksk) for ksk in matched_ksks])
+    return {
+        "/ksk-as-dnskey.txt": make_response(dnskey_records.encode("ascii"), "text/plain"),
+        "/ksk-as-ds.txt": make_response(ds_records.encode("ascii"), "text/plain"),
+        "/root-anchors.xml": make_response(trust_anchor_xml, "application/xml"),
+        "/bind-trusted-keys.conf": make_response(ksks_as_bind_keys(matched_ksks,\
+            "trusted-keys", "").encode("ascii"), "text/plain"),
+        "/bind-managed-keys.conf": make_response(ksks_as_bind_keys(matched_ksks,\
+            "managed-keys", "initial-key ").encode("ascii"), "text/plain")
+    }
+
+
+class TrustAnchorRequestHandler(BaseHTTPRequestHandler):
+    """Serves the precomputed responses of the server, with conditional GET and gzip"""
+    protocol_version = "HTTP/1.1"
+    # Buffer each response so headers and body leave in a single write
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Handle HEAD"""
+        self.send_precomputed(send_body=False)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle GET"""
+        self.send_precomputed(send_body=True)
+
+    def send_precomputed(self, send_body):
+        """Send the precomputed response for the path, or a 404"""
+        response = self.server.responses.get(self.path.split("?")[0])
+        if response is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        accept_encoding = self.headers.get("Accept-Encoding", "")
+        if "gzip" in [value.split(";")[0].strip() for value in accept_encoding.split(",")]:
+            (body, etag) = response["gzip"]
+            content_encoding = "gzip"
+        else:
+            (body, etag) = response["identity"]
+            content_encoding = None
+        # If-None-Match uses the weak comparison, so W/"..." matches "..." (RFC 7232, 3.2)
+        if_none_match = [value.strip() for value in\
+            self.headers.get("If-None-Match", "").split(",")]
+        if etag in [value[2:] if value.startswith("W/") else value for value in if_none_match]\
+            or if_none_match == ["*"]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", response["type"])
+        self.send_header("Content-Length", str(len(body)))
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Only log requests when asked to"""
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class TrustAnchorServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server for the precomputed trust anchor responses"""
+    daemon_threads = True
+
+    def __init__(self, server_address, responses, verbose=False):
+        HTTPServer.__init__(self, server_address, TrustAnchorRequestHandler)
+        self.responses = responses
+        self.verbose = verbose
+
+
+class TrustAnchorServerIPv6(TrustAnchorServer):
+    """Threaded HTTP server for the precomputed trust anchor responses, over IPv6"""
+    address_family = socket.AF_INET6
+
+
+def parse_listen_address(listen):
+    """Takes '[host:]port', with IPv6 hosts in brackets; returns a (host, port) tuple"""
+    (host, _, port) = listen.rpartition(":")
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    try:
+        port = int(port)
+    except ValueError:
+        die("The listen address '{}' is not of the form [host:]port.".format(listen))
+    return (host or "127.0.0.1", port)
+
+
+def make_server(listen, responses, verbose=False):
+    """Takes '[host:]port', the responses and verbosity; returns a server bound to
+        the address, over IPv6 if the host is an IPv6 address"""
+    server_address = parse_listen_address(listen)
+    if ":" in server_address[0]:
+        return TrustAnchorServerIPv6(server_address, responses, verbose=verbose)
+    return TrustAnchorServer(server_address, responses, verbose=verbose)
+
+
+def run_benchmark(responses, request_count, client_count):
+    """Takes the responses, number of requests and clients; serves the responses on a
+        local port and returns (requests per second, p99 latency in seconds)"""
+    server = TrustAnchorServer(("127.0.0.1", 0), responses)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    (host, port) = server.server_address[0:2]
+    paths = sorted(responses.keys())
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def client(client_requests):
+        """Issue requests over one kept-alive connection, recording latencies"""
+        connection = HTTPConnection(host, port)
+        client_latencies = []
+        for count in range(client_requests):
+            path = paths[count % len(paths)]
+            headers = {"Accept-Encoding": "gzip"} if count % 2 else {}
+            start = time.time()
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            client_latencies.append(time.time() - start)
+        connection.close()
+        with latencies_lock:
+            latencies.extend(client_latencies)
+
+    clients = []
+    for count in range(client_count):
+        client_requests = request_count // client_count
+        if count < request_count % client_count:
+            client_requests += 1
+        clients.append(threading.Thread(target=client, args=(client_requests,)))
+    start = time.time()
+    for this_client in clients:
+        this_client.start()
+    for this_client in clients:
+        this_client.join()
+    elapsed = time.time() - start
+    server.shutdown()
+    server.server_close()
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return (len(latencies) / elapsed, p99)
+
+
+def timed(function, timings):
+    """Takes a function and a dict; returns the function wrapped to record
+        the duration of each call in the dict"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        """Record the call duration"""
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.setdefault(function.__name__, []).append(time.time() - start)
+    return wrapper
+
+
+def run_profiled(function, prefix, top):
+    """Takes a function, file name prefix and count; runs the function under cProfile
+        (and tracemalloc when available) and writes prefix.pstats and prefix.alloc"""
+    this_module = sys.modules[__name__]
+    timings = {}
+    originals = dict([(name, getattr(this_module, name)) for name in PROFILED_FUNCTIONS])
+    for (name, original) in originals.items():
+        setattr(this_module, name, timed(original, timings))
+    if tracemalloc:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(function)
+    finally:
+        for (name, original) in originals.items():
+            setattr(this_module, name, original)
+        report_lines = []
+        if tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            (_, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report_lines.append("Peak traced memory: {} bytes".format(peak))
+            report_lines.append("Top {} allocation sites:".format(top))
+            for this_stat in snapshot.statistics("lineno")[0:top]:
+                report_lines.append("  {}".format(this_stat))
+        else:
+            report_lines.append("Allocation tracing is not available in this Python.")
+        report_lines.append("Hot functions:")
+        for name in PROFILED_FUNCTIONS:
+            durations = timings.get(name, [])
+            report_lines.append("  {}: calls={} total={:.6f}s max={:.6f}s".format(name,\
+                len(durations), sum(durations), max(durations or [0])))
+        profiler.dump_stats(prefix + ".pstats")
+        with open(prefix + ".alloc", "w") as alloc_file:
+            alloc_file.write("\n".join(report_lines) + "\n")
+        print("Wrote the profile to {0}.pstats and {0}.alloc.".format(prefix))
+
+
 def main():
     """Main function"""
 
+    cmd_parse = argparse.ArgumentParser(description="DNSSEC Trust Anchor Tool")
+    cmd_parse.add_argument("--local", dest="local", type=str,\
+        help="Name of local file to use instead of getting the trust anchor from the URL")
+    cmd_parse.add_argument("--zonefile", dest="zonefile", type=str,\
+        help="Name of local root zone file to get the KSKs from, checking the RRSIG over them")
+    cmd_parse.add_argument("--rrsig-cache", dest="rrsig_cache", type=str, metavar="FILE",\
+        help="Cache RRSIG validation results in FILE between runs")
+    cmd_parse.add_argument("--inventory", dest="inventory", type=str, metavar="FILE",\
+        help="Write an inventory of the DS records of the delegations in the root zone to FILE")
+    cmd_parse.add_argument("--children", dest="children", type=str, metavar="PATH",\
+        help="File or directory of child DNSKEY snapshots to check the DS records against")
+    cmd_parse.add_argument("--workers", dest="workers", type=int,\
+        default=DEFAULT_INVENTORY_WORKERS, help="Number of processes checking DS records")
+    cmd_parse.add_argument("--deadline", dest="deadline", type=float, metavar="SECONDS",\
+        help="Overall time budget, split into timeouts for the steps that use the network")
+    cmd_parse.add_argument("--url-anchors", dest="url_anchors", type=str,\
+        default=URL_ROOT_ANCHORS, help="URL of the trust anchor file")
+    cmd_parse.add_argument("--url-signature", dest="url_signature", type=str,\
+        default=URL_ROOT_ANCHORS_SIGNATURE, help="URL of the signature of the trust anchor file")
+    cmd_parse.add_argument("--url-resolver", dest="url_resolver", type=str,\
+        default=URL_RESOLVER_API, help="URL of the Google Public DNS query for the root KSKs")
+    cmd_parse.add_argument("--url-zone", dest="url_zone", type=str,\
+        default=URL_ROOT_ZONE, help="URL of the root zone file")
+    cmd_parse.add_argument("--keep", dest="keep", action='store_true',\
+        help="Keep the temporary files (the XML and validating signature")
+    cmd_parse.add_argument("--serve", dest="serve", type=str, metavar="[HOST:]PORT",\
+        help="Serve the results over HTTP instead of writing them out")
+    cmd_parse.add_argument("--benchmark", dest="benchmark", type=int, metavar="REQUESTS",\
+        help="Benchmark serving the results over HTTP with a local client")
+    cmd_parse.add_argument("--benchmark-clients", dest="benchmark_clients", type=int,\
+        default=DEFAULT_BENCHMARK_CLIENTS, help="Number of concurrent benchmark clients")
+    cmd_parse.add_argument("--profile", dest="profile", type=str, metavar="PREFIX",\
+        help="Profile the run, writing PREFIX.pstats and PREFIX.alloc")
+    cmd_parse.add_argument("--profile-top", dest="profile_top", type=int,\
+        default=DEFAULT_PROFILE_TOP, help="Number of allocation sites in the profile report")
+    opts = cmd_parse.parse_args()
+
+    if opts.profile:
+        run_profiled(functools.partial(run, opts), opts.profile, opts.profile_top)
+    else:
+        run(opts)
+
+
+def run(opts):
+    """Takes the command line options; runs all of the steps within the time budget, and
+        reports the time each step used if there is a deadline"""
+    budget = Budget(opts.deadline)
+    try:
+        run_steps(opts, budget)
+    finally:
+        budget.report()
+
+
+def run_steps(opts, budget):
+    """Takes the command line options and the time budget; runs all of the steps"""
+
     # Where the files we create are kept
     (_, trust_anchor_filename) = tempfile.mkstemp(prefix="trust_anchor_")
     (_, signature_filename) = tempfile.mkstemp(prefix="signature_")
@@ -390,13 +1331,6 @@ def main():
     dnskey_record_filename = "ksk-as-dnskey.txt"
     ds_record_filename = "ksk-as-ds.txt"
 
-    cmd_parse = argparse.ArgumentParser(description="DNSSEC Trust Anchor Tool")
-    cmd_parse.add_argument("--local", dest="local", type=str,\
-        help="Name of local file to use instead of getting the trust anchor from the URL")
-    cmd_parse.add_argument("--keep", dest="keep", action='store_true',\
-        help="Keep the temporary files (the XML and validating signature")
-    opts = cmd_parse.parse_args()
-
     # Make sure there is an "openssl" command in their shell path
     which_return = subprocess.call("which openssl", shell=True, stdout=subprocess.PIPE)
     if which_return != 0:
@@ -413,24 +1347,25 @@ def main():
     else:
         # Get the trust anchor file from its URL, write it to disk
         try:
-            trust_anchor_url = urlopen(URL_ROOT_ANCHORS)
+            with budget.step("anchors") as timeout:
+                trust_anchor_xml = http_get(opts.url_anchors, timeout=timeout)
         except Exception as this_exception:
             die("Was not able to open URL {}. The returned text was '{}'.".format(\
-                URL_ROOT_ANCHORS, this_exception))
-        trust_anchor_xml = trust_anchor_url.read()
-        trust_anchor_url.close()
+                opts.url_anchors, this_exception))
     write_out_file(trust_anchor_filename, trust_anchor_xml)
 
     ### Step 2. Fetch the S/MIME signature for the trust anchor file from
-    ### IANA using HTTPS. Get the signature file from its URL, write it to disk.
-    try:
-        signature_url = urlopen(URL_ROOT_ANCHORS_SIGNATURE)
-    except Exception as this_exception:
-        die("Was not able to open URL {}. returned text was '{}'.".format(\
-            URL_ROOT_ANCHORS_SIGNATURE, this_exception))
-    signature_contents = signature_url.read()
-    signature_url.close()
-    write_out_file(signature_filename, signature_contents)
+    ### IANA using HTTPS, on the connection kept alive from step 1. Get the
+    ### signature file from its URL, write it to disk. Skip this step if using
+    ### a local file, as the signature is not validated then.
+    if not opts.local:
+        try:
+            with budget.step("signature") as timeout:
+                signature_contents = http_get(opts.url_signature, timeout=timeout)
+        except Exception as this_exception:
+            die("Was not able to open URL {}. returned text was '{}'.".format(\
+                opts.url_signature, this_exception))
+        write_out_file(signature_filename, signature_contents)
 
     ### Step 3. Validate the signature on the trust anchor file using a
     ### built-in IANA CA key. Skip this step if using a local file.
@@ -438,7 +1373,9 @@ def main():
         print("Not validating the local trust anchor file.")
     else:
         write_out_file(icann_ca_filename, ICANN_ROOT_CA_CERT)
-        validate_detached_signature(trust_anchor_filename, signature_filename, icann_ca_filename)
+        with budget.step("validate") as timeout:
+            validate_detached_signature(trust_anchor_filename, signature_filename,\
+                icann_ca_filename, timeout)
 
     ### Step 4. Extract the trust anchor key digests from the trust anchor file
     trust_anchors = extract_trust_anchors_from_xml(trust_anchor_xml)
@@ -448,16 +1385,29 @@ def main():
 
     ### Step 6. Verify that the trust anchors match the published KSKs
     ### file.
-    ksk_records = fetch_ksk()
+    ds_index = {} if opts.inventory else None
+    (ksk_records, apex) = fetch_ksk(opts.zonefile, ds_index, budget, opts.url_resolver,\
+        opts.url_zone)
     for key in ksk_records:
         print("Found KSK {flags} {proto} {alg} '{keystart}...{keyend}'.".format(\
             flags=key['f'], proto=key['p'], alg=key['a'],
             keystart=key['k'][0:15], keyend=key['k'][-15:]))
     # Go trough all the KSKs, decoding them and comparing them to all the trust anchors
     matched_ksks = get_matching_ksk(ksk_records, valid_trust_anchors)
+    # When the KSKs came from the root zone file, check that a matched KSK signed them
+    if apex is not None:
+        check_dnskey_rrsig(apex, matched_ksks, opts.rrsig_cache)
+    # Check the DS records of the delegations against the child DNSKEY snapshots
+    if opts.inventory:
+        ds_inventory = check_delegations(ds_index, opts.children, opts.workers)
+        report_ds_inventory(ds_inventory)
 
     ### Step 7. Write out the trust anchors as a DNSKEY and DS records.
-    export_ksk(matched_ksks, ds_record_filename, dnskey_record_filename)
+    if not (opts.serve or opts.benchmark):
+        export_ksk(matched_ksks, ds_record_filename, dnskey_record_filename)
+    if opts.inventory:
+        print("Writing out {}.".format(opts.inventory))
+        write_out_file(opts.inventory, ds_inventory_as_text(ds_inventory))
     # Delete the temporary files unless requested not to
     if opts.keep:
         print("Kept the temporary files: {}".format(" ".join(temp_files)))
@@ -470,5 +1420,25 @@ def main():
                 except Exception as this_exception:
                     print("Could not delete {}: '{}'. Continuing".format(this_file, this_exception))
 
+    ### Or serve the trust anchors over HTTP, with every response rendered up front.
+    if not (opts.serve or opts.benchmark):
+        return
+    responses = make_served_responses(trust_anchor_xml, matched_ksks)
+    if opts.benchmark:
+        print("Benchmarking {} requests with {} clients...".format(opts.benchmark,\
+            opts.benchmark_clients))
+        (requests_per_second, p99_latency) = run_benchmark(responses, opts.benchmark,\
+            opts.benchmark_clients)
+        print("{:.0f} requests/sec, p99 latency {:.3f} ms".format(requests_per_second,\
+            p99_latency * 1000))
+    if opts.serve:
+        server = make_server(opts.serve, responses, verbose=True)
+        print("Serving {} on {}:{}.".format(" ".join(sorted(responses.keys())),\
+            *server.server_address[0:2]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
 if __name__ == "__main__":
     main()
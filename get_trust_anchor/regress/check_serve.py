@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2016, Paul Hoffman. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+HTTP client check of get_trust_anchor.py --serve (check_serve.py)
+
+Runs the given command, which must serve on an ephemeral port and print its "Serving ... on
+host:port." line, then checks a plain 200, a gzip 200, a 304 for the strong and the weak
+form of the ETag, and a 404, and stops the server. Exits non-zero on the first failed check.
+"""
+
+# pylint: disable=wrong-import-position,import-error
+
+from __future__ import print_function
+
+import gzip
+import io
+import re
+import subprocess
+import sys
+
+if sys.version_info[0] == 2:
+    from httplib import HTTPConnection
+else:
+    from http.client import HTTPConnection
+
+SERVING_PATTERN = re.compile(r"^Serving .* on (.*):(\d+)\.$")
+CHECK_PATH = "/ksk-as-ds.txt"
+
+
+def check(description, condition):
+    """Takes a description and a condition; exits if the condition is false"""
+    if not condition:
+        print("check_serve: FAILED: {}".format(description))
+        sys.exit(1)
+    print("check_serve: {}".format(description))
+
+
+def request(connection, headers):
+    """Takes a connection and request headers; returns (status, headers, body)"""
+    connection.request("GET", CHECK_PATH, headers=headers)
+    response = connection.getresponse()
+    return (response.status, dict((name.lower(), value) for (name, value) in\
+        response.getheaders()), response.read())
+
+
+def run_checks(host, port):
+    """Takes the address of the server; runs all checks against it"""
+    connection = HTTPConnection(host, port, timeout=10)
+    (status, headers, body) = request(connection, {})
+    check("200 identity", status == 200 and body and "content-encoding" not in headers)
+    etag = headers["etag"]
+    (status, gzip_headers, gzip_body) = request(connection, {"Accept-Encoding": "gzip"})
+    check("200 gzip", status == 200 and gzip_headers.get("content-encoding") == "gzip"\
+        and gzip.GzipFile(fileobj=io.BytesIO(gzip_body)).read() == body)
+    (status, _, _) = request(connection, {"If-None-Match": etag})
+    check("304 strong ETag", status == 304)
+    (status, _, _) = request(connection, {"Accept-Encoding": "gzip",\
+        "If-None-Match": "W/" + gzip_headers["etag"]})
+    check("304 weak ETag", status == 304)
+    (status, _, _) = request(connection, {"If-None-Match": '"stale"'})
+    check("200 stale ETag", status == 200)
+    connection.request("GET", "/missing")
+    response = connection.getresponse()
+    response.read()
+    check("404 unknown path", response.status == 404)
+    connection.close()
+
+
+def main():
+    """Main function"""
+    command = sys.argv[2:] if sys.argv[1:2] == ["--"] else sys.argv[1:]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        for line in iter(server.stdout.readline, ""):
+            match = SERVING_PATTERN.match(line.strip())
+            if match:
+                run_checks(match.group(1), int(match.group(2)))
+                return 0
+        print("check_serve: FAILED: the server did not start")
+        return 1
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
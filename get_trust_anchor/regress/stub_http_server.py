@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2016, Paul Hoffman. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Stub HTTP server for regression tests (stub_http_server.py)
+
+Serves the files in a directory on one port, and accepts connections on another port but
+never answers on them. If a command is given, it is run while the server is up and its exit
+status is returned.
+"""
+
+# pylint: disable=wrong-import-position,import-error
+
+from __future__ import print_function
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+if sys.version_info[0] == 2:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+else:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files from the current directory without logging"""
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def stall(listen_socket):
+    """Takes a listening socket; accepts connections and holds them open without answering"""
+    held = []
+    while True:
+        try:
+            (connection, _) = listen_socket.accept()
+        except socket.error:
+            return
+        held.append(connection)
+
+
+def main():
+    """Main function"""
+    cmd_parse = argparse.ArgumentParser(description="Stub HTTP server")
+    cmd_parse.add_argument("--directory", dest="directory", type=str, required=True,\
+        help="Directory of files to serve")
+    cmd_parse.add_argument("--port", dest="port", type=int, required=True,\
+        help="Port to serve the files on")
+    cmd_parse.add_argument("--stall-port", dest="stall_port", type=int, required=True,\
+        help="Port to accept connections on but never answer")
+    cmd_parse.add_argument("command", nargs=argparse.REMAINDER,\
+        help="Command to run while serving")
+    opts = cmd_parse.parse_args()
+
+    command_directory = os.getcwd()
+    os.chdir(opts.directory)
+    server = ThreadingHTTPServer(("127.0.0.1", opts.port), QuietHandler)
+    server_thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    server_thread.daemon = True
+    server_thread.start()
+    stall_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    stall_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    stall_socket.bind(("127.0.0.1", opts.stall_port))
+    stall_socket.listen(16)
+    stall_thread = threading.Thread(target=stall, args=(stall_socket,))
+    stall_thread.daemon = True
+    stall_thread.start()
+
+    command = opts.command[1:] if opts.command[:1] == ["--"] else opts.command
+    if not command:
+        try:
+            while True:
+                stall_thread.join(3600)
+        except KeyboardInterrupt:
+            return 0
+    status = subprocess.call(command, cwd=command_directory)
+    server.shutdown()
+    stall_socket.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())